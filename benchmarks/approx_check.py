@@ -0,0 +1,83 @@
+'''
+    The error budget check of the approximate qtscalc.
+
+    The initial states are on a strict subset of the register, so that qtscalc extends them by 
+    the identity. The approximation should behave as for the normalized extension (by the 
+    maximally mixed state) given explicitly : the same threshold, rounds and error, with the 
+    results scaled by the extension. And the exact results should be within the error bound 
+    (in the scale of the initial state) of the approximate ones.
+
+    Usage:
+        python benchmarks/approx_check.py [--steps 30] [--budget 0.1]
+'''
+
+from __future__ import annotations
+from typing import List
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from yamata import compile, qtscalc, VMat, QVar
+
+# (code, qubits of the initial state |0><0|, the register)
+PROGRAMS = [
+    ("H[q]; CX[q p]; while # M1[q] -> H[q]; CX[q p] # M0[q] -> end", ['q'], ['q', 'p']),
+    ("H[q]; H[p]; { while # M1[q] -> H[q]; CX[q p] # M0[q] -> end "
+     "|| while # M1[p] -> H[p]; Y[q] # M0[p] -> end }", ['q'], ['q', 'p']),
+    ("[c b] :=0; { loop if # M0[c] -> H[b]; X[c] # M1[c] -> skip end end "
+     "|| if # M0[b] -> skip # M1[b] -> X[d] end }", ['c'], ['c', 'b', 'd']),
+]
+
+def rho_list(qts, reg : QVar) -> List[np.ndarray]:
+    ls = qts.ls if hasattr(qts, 'ls') else [qts]
+    return [x.rho.extend_to(reg).mat for x in ls]
+
+def hausdorff(a : List[np.ndarray], b : List[np.ndarray]) -> float:
+    '''
+        the Hausdorff distance in trace norm
+    '''
+    def dist(x : np.ndarray, y : np.ndarray) -> float:
+        return float(np.sum(np.abs(np.linalg.eigvalsh(x - y))))
+    return max(max(min(dist(x, y) for y in b) for x in a), max(min(dist(x, y) for y in a) for x in b))
+
+
+def main() -> int:
+    arg_parser = argparse.ArgumentParser(description = "Check the error budget of the approximate qtscalc.")
+    arg_parser.add_argument("--steps", type = int, default = 30)
+    arg_parser.add_argument("--budget", type = float, default = 0.1)
+    args = arg_parser.parse_args()
+
+    ok = True
+    for code, qubits, register in PROGRAMS:
+        fc = compile(code)
+        reg = QVar(register)
+        k = len(register) - len(qubits)
+        rho = VMat(QVar(qubits), np.diag([1.] + [0.] * (2**len(qubits) - 1)).astype(complex))
+        # the normalized extension, on the whole register
+        rho_ext = VMat(reg, rho.extend_to(reg).mat / 2**k)
+
+        approx = qtscalc(fc, rho, args.steps, error_budget = args.budget)
+        approx_ext = qtscalc(fc, rho_ext, args.steps, error_budget = args.budget)
+        exact = qtscalc(fc, rho, args.steps, reduce = True)
+
+        a, a_ext = rho_list(approx.qts, reg), rho_list(approx_ext.qts, reg)
+        same = approx.threshold == approx_ext.threshold and approx.rounds == approx_ext.rounds \
+            and abs(approx.error - approx_ext.error) < 1e-9 \
+            and hausdorff(a, [2**k * x for x in a_ext]) < 1e-9
+        distance = hausdorff(rho_list(exact, reg), a) / 2**k
+        within = same and distance <= approx.error + 1e-9
+        ok = ok and within
+
+        print("%-70s error %.2e (distance %.2e) threshold %.1e, %d rounds  %s" 
+              % (code[:70], approx.error, distance, approx.threshold, approx.rounds, 
+                 "OK" if within else "MISMATCH"))
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+'''
+    The import time budget of yamata.
+
+    Every statement is timed in fresh interpreters, and the best time over the runs (the least
+    disturbed one, as timeit does) is compared with the budget. The time of importing numpy is measured as well and subtracted, since 
+    it dominates and depends on the machine. The modules which should only be loaded on 
+    demand are checked not to be imported.
+
+    Usage:
+        python benchmarks/import_time.py [--runs 7] [--budget-ms 75]
+'''
+
+from __future__ import annotations
+from typing import List
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATEMENTS = [
+    "import yamata",
+    "from yamata import compile, vecsim",
+]
+
+# the modules deferred until they are used
+DEFERRED = ["graphviz", "tqdm", "ply", "multiprocessing", "yamata.qparsing.vparser"]
+
+PROBE = '''
+import sys, time, json
+t = time.perf_counter()
+{stmt}
+t = time.perf_counter() - t
+print(json.dumps({{"time" : t, "modules" : sorted(sys.modules)}}))
+'''
+
+def measure(stmt : str, runs : int) -> tuple[float, List[str]]:
+    '''
+        the best time of [stmt] in fresh interpreters, and the modules loaded by it
+    '''
+    times = []
+    modules : List[str] = []
+    env = dict(os.environ, PYTHONPATH = ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE.format(stmt = stmt)], env = env,
+                             check = True, capture_output = True, text = True).stdout
+        r = json.loads(out.splitlines()[-1])
+        times.append(r["time"])
+        modules = r["modules"]
+    return min(times), modules
+
+
+def main() -> int:
+    arg_parser = argparse.ArgumentParser(description = "Check the import time budget of yamata.")
+    arg_parser.add_argument("--runs", type = int, default = 7)
+    arg_parser.add_argument("--budget-ms", type = float, default = 75.,
+                            help = "the budget beyond importing numpy, in milliseconds")
+    args = arg_parser.parse_args()
+
+    base, _ = measure("import numpy", args.runs)
+    print("%-40s %8.1f ms" % ("import numpy", base * 1e3))
+
+    ok = True
+    for stmt in STATEMENTS:
+        t, modules = measure(stmt, args.runs)
+        extra = (t - base) * 1e3
+        loaded = [m for m in DEFERRED if m in modules]
+        within = extra <= args.budget_ms and len(loaded) == 0
+        ok = ok and within
+
+        print("%-40s %8.1f ms  (+%.1f ms over numpy, budget %.1f ms)  %s" 
+              % (stmt, t * 1e3, extra, args.budget_ms, "OK" if within else "OVER"))
+        if len(loaded) > 0:
+            print("    loaded eagerly: " + ", ".join(loaded))
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
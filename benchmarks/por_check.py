@@ -0,0 +1,73 @@
+'''
+    The partial order reduction check of yamata.
+
+    The programs are simulated by vecsim on the flowcharts compiled with and without the 
+    partial order reduction, and the frequencies of every result are compared. They should 
+    agree within the sampling error, in particular for the programs that may abort.
+
+    Usage:
+        python benchmarks/por_check.py [--shots 3000] [--seed 0]
+'''
+
+from __future__ import annotations
+from typing import List, Tuple
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from yamata import compile, vecsim, VVec, QVar, VecSimRes
+
+# (code, qubits of the initial state |0...0>)
+PROGRAMS = [
+    ("{ H[q]; H[q] || abort }", ['q']),
+    ("{ H[q]; X[p] || if # M0[p] -> abort # M1[p] -> skip end }", ['q', 'p']),
+    ("{ H[q]; CX[q p] || X[r]; abort || H[p] }", ['q', 'p', 'r']),
+    ("{ H[q]; H[q] || X[p]; H[p] }", ['q', 'p']),
+]
+
+def frequencies(res : VecSimRes, shots : int) -> List[Tuple[np.ndarray | None, float]]:
+    '''
+        the results and their frequencies
+    '''
+    return [(None if rec.stt is None else rec.stt.vec, len(rec) / shots) 
+            for rec in res.records if len(rec) > 0]
+
+
+def main() -> int:
+    arg_parser = argparse.ArgumentParser(description = "Check the partial order reduction of yamata.")
+    arg_parser.add_argument("--shots", type = int, default = 3000)
+    arg_parser.add_argument("--seed", type = int, default = 0)
+    args = arg_parser.parse_args()
+
+    ok = True
+    for code, qubits in PROGRAMS:
+        vinit = VVec(QVar(qubits), np.eye(2**len(qubits))[0].astype(complex))
+        fc_full, fc_por = compile(code), compile(code, por = True)
+        f_full = frequencies(vecsim(fc_full, vinit, 100, args.shots, seed = args.seed), args.shots)
+        f_por = frequencies(vecsim(fc_por, vinit, 100, args.shots, seed = args.seed + 1), args.shots)
+
+        # the results matched in both directions, with the frequencies within 5 sigma
+        def deviation(a : List[Tuple[np.ndarray | None, float]], b : List[Tuple[np.ndarray | None, float]]) -> float:
+            r = 0.
+            for vec, p in a:
+                q = sum(p_b for vec_b, p_b in b if (vec is None and vec_b is None) or 
+                        (vec is not None and vec_b is not None and np.allclose(vec, vec_b)))
+                sigma = np.sqrt(max(p * (1 - p), 1 / args.shots) * 2 / args.shots)
+                r = max(r, abs(p - q) / sigma)
+            return r
+        dev = max(deviation(f_full, f_por), deviation(f_por, f_full))
+        within = dev <= 5.
+        ok = ok and within
+
+        print("%-60s %4d -> %4d vertices, deviation %.1f sigma  %s" 
+              % (code, len(fc_full.vertices), len(fc_por.vertices), dev, "OK" if within else "MISMATCH"))
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
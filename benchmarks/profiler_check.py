@@ -0,0 +1,75 @@
+'''
+    The coverage check of the profiler on the calculation engines.
+
+    Every engine is run inside a profiler, which should record the visits and the edges of its 
+    steps, and restore the instrumented functions when disabled. The fixpoint engine takes one 
+    step for every reachable state that is not terminal.
+
+    Usage:
+        python benchmarks/profiler_check.py [--steps 20]
+'''
+
+from __future__ import annotations
+from typing import List, Tuple, Callable
+
+import os
+import sys
+import argparse
+import importlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from yamata import compile, qtscalc, fixpoint, Profiler, VMat, QVar
+
+qtscalc_module = importlib.import_module("yamata.qtscalc")
+
+# (code, qubits of the initial state |0><0|)
+PROGRAMS = [
+    ("H[q]; while # M1[q] -> H[q] # M0[q] -> end", ['q']),
+    ("H[q]; CX[q p]; while # M1[q] -> H[q]; CX[q p] # M0[q] -> end", ['q', 'p']),
+    ("H[q]; H[p]; { while # M1[q] -> H[q] # M0[q] -> end "
+     "|| while # M1[p] -> H[p] # M0[p] -> end }", ['q', 'p']),
+]
+
+
+def main() -> int:
+    arg_parser = argparse.ArgumentParser(description = "Check the profiler on the calculation engines.")
+    arg_parser.add_argument("--steps", type = int, default = 20)
+    args = arg_parser.parse_args()
+
+    originals = (qtscalc_module.qtscalc_iter, qtscalc_module.rho_branches)
+
+    ok = True
+    for code, qubits in PROGRAMS:
+        rho = VMat(QVar(qubits), np.diag([1.] + [0.] * (2**len(qubits) - 1)).astype(complex))
+
+        engines : List[Tuple[str, Callable[..., object]]] = [
+            ("tree", lambda fc : qtscalc(fc, rho, args.steps)),
+            ("reduced", lambda fc : qtscalc(fc, rho, args.steps, reduce = True)),
+            ("fixpoint", lambda fc : fixpoint(fc, rho)),
+        ]
+        for name, run in engines:
+            fc = compile(code)
+            with Profiler() as prof:
+                res = run(fc)
+            report = prof.report
+
+            visits = sum(report.vertex_visits.values())
+            edges = sum(report.edge_count.values())
+            covered = visits > 0 and edges > 0 \
+                and all(fc.vertices[vid].id == vid for vid in report.vertex_visits)
+            if name == "fixpoint":
+                covered = covered and 0 < visits < res.states
+            restored = (qtscalc_module.qtscalc_iter, qtscalc_module.rho_branches) == originals \
+                and Profiler.current() is None
+            ok = ok and covered and restored
+
+            print("%-70s %-8s %6d visits %6d edges  %s" 
+                  % (code[:70], name, visits, edges, "OK" if covered and restored else "MISMATCH"))
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+'''
+    The statistics check of the vecsim records.
+
+    The mean, variance and percentiles of the running steps in VecRecord are compared with 
+    numpy on random histograms, including the boundaries q = 0 and q = 100 and the histograms 
+    without the small step numbers, and the empty record is checked to raise ValueError.
+
+    Usage:
+        python benchmarks/record_check.py [--trials 200] [--seed 0]
+'''
+
+from __future__ import annotations
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from yamata.vecSim import VecRecord
+
+
+def check_empty() -> bool:
+    rec = VecRecord(None, 10)
+    for f in (rec.mean, rec.var, lambda : rec.percentile(50)):
+        try:
+            f()
+        except ValueError:
+            continue
+        return False
+    return True
+
+
+def check_random(trials : int, seed : int) -> bool:
+    rng = np.random.default_rng(seed)
+    for _ in range(trials):
+        step_bound = int(rng.integers(1, 50))
+        rec = VecRecord(None, step_bound)
+        # the steps recorded from a random least step on
+        low = int(rng.integers(0, step_bound + 1))
+        steps = rng.integers(low, step_bound + 1, size = int(rng.integers(1, 100)))
+        for s in steps:
+            rec.append(int(s))
+
+        if not np.isclose(rec.mean(), np.mean(steps)) or not np.isclose(rec.var(), np.var(steps)):
+            return False
+        if rec.percentile(0) != np.min(steps) or rec.percentile(100) != np.max(steps):
+            return False
+        for q in (1, 25, 50, 75, 99):
+            if rec.percentile(q) != np.percentile(steps, q, method = 'inverted_cdf'):
+                return False
+    return True
+
+
+def main() -> int:
+    arg_parser = argparse.ArgumentParser(description = "Check the statistics of the vecsim records.")
+    arg_parser.add_argument("--trials", type = int, default = 200)
+    arg_parser.add_argument("--seed", type = int, default = 0)
+    args = arg_parser.parse_args()
+
+    ok = True
+    for name, within in [("empty record", check_empty()), 
+                         ("random histograms", check_random(args.trials, args.seed))]:
+        ok = ok and within
+        print("%-40s %s" % (name, "OK" if within else "MISMATCH"))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
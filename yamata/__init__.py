@@ -1,4 +1,8 @@
-from .compile import compile
-from .qtscalc import qtscalc, Qts
+from .compile import compile, CompileAbort, LazyFlowchart
+from .cache import CompileCache
+from .flowchart.compact import CompactFlowchart
+from .qtscalc import qtscalc, Qts, ApproxQts
+from .fixpoint import fixpoint, FixpointRes
 from .vecSim import vecsim, VecSimRes, VecRecord
-from .backend import VVec, VMat, QVar, OptEnv, get_optlib
\ No newline at end of file
+from .backend import VVec, VMat, QVar, OptEnv, get_optlib
+from .profiler import Profiler, ProfileReport
\ No newline at end of file
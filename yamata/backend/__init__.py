@@ -1,3 +1,4 @@
 from .optlib import OptEnv, get_optlib
 from .backend import *
-from .sample import *
\ No newline at end of file
+from .sample import *
+from .index import *
\ No newline at end of file
@@ -1,7 +1,7 @@
 # numpy calculation backend
 
 from __future__ import annotations
-from typing import List, Type, Tuple
+from typing import List, Type, Tuple, Dict
 
 import numpy as np
 
@@ -16,6 +16,17 @@ def ls_uniqueness_check(ls : List) -> bool:
                 return False
     return True
 
+def tensor_apply(tensor : np.ndarray, opt : np.ndarray, axes : Tuple[int, ...]) -> np.ndarray:
+    '''
+    Apply the k-qubit operator [opt] (a 2^k x 2^k matrix) on the given [axes]
+    of [tensor] (in the (2, 2, ..., 2) shape), by contracting only these axes.
+    The result keeps the axis order of [tensor].
+    '''
+    k = len(axes)
+    opt_t = opt.reshape((2,)*2*k)
+    res = np.tensordot(opt_t, tensor, (list(range(k, 2*k)), list(axes)))
+    return np.moveaxis(res, list(range(k)), list(axes))
+
 class QVar:
     def __init__(self, _ls : List[str]):
         if not ls_uniqueness_check(_ls):
@@ -23,13 +34,24 @@ class QVar:
         
         self.ls : List[str] = _ls
 
+        # the axis of every variable, and the cached permutations to other qvars
+        self._idx : Dict[str, int] = {id : i for i, id in enumerate(_ls)}
+        self._perm_cache : Dict[Tuple[str, ...], Tuple[int, ...]] = {}
+
     def appended(self, id : str) -> QVar:
         return QVar(self.ls + [id])
     
     def __len__(self) -> int:
         return len(self.ls)
     
+    def __contains__(self, id : str) -> bool:
+        return id in self._idx
+    
     def __add__(self, b : QVar) -> QVar:
+        # keep the same object if nothing is appended, so that its cache is reused
+        if b is self or all(i in self._idx for i in b.ls):
+            return self
+
         r = self.ls.copy()
         for i in b.ls:
             if i not in r:
@@ -53,14 +75,21 @@ class QVar:
 
     
 
-    def perm_idx_to(self, qvar : QVar) -> Tuple[int]:
+    def perm_idx_to(self, qvar : QVar) -> Tuple[int, ...]:
         '''
         The permutation from the current qvar to the desired qvar.
+        It also gives the axes of [qvar] in this qvar when [qvar] is a part of it.
+        The result is cached for every target.
         '''
-        r : List[int] = []
-        for i in qvar.ls:
-            r.append(self.ls.index(i))
-        return tuple(r)
+        key = tuple(qvar.ls)
+        r = self._perm_cache.get(key)
+        if r is None:
+            try:
+                r = tuple(self._idx[i] for i in key)
+            except KeyError as e:
+                raise ValueError("Variable " + str(e) + " is not in " + str(self) + ".")
+            self._perm_cache[key] = r
+        return r
 
 
 
@@ -116,6 +145,9 @@ class VVec(VTerm):
         return np.max(np.abs((self - other).vec)) < self.eps
 
     def transform_to(self, tgt_qvar: QVar) -> VVec:
+        if tgt_qvar is self.qvar or tgt_qvar == self.qvar:
+            return self
+
         qvar_perm = list(self.qvar.perm_idx_to(tgt_qvar))
 
         new_v = self.vec.reshape((2,)*self.qnum).transpose(qvar_perm)
@@ -165,12 +197,15 @@ class VVec(VTerm):
     def Mapply(self, vmat : VMat) -> VVec:
         '''
             return the result of applying vmat on this vvec, in the qvar order of current vvec.
+            Only the axes of the qubits in vmat are contracted, so the operator is never
+            extended to the whole register.
         '''
         common_qvar = self.qvar + vmat.qvar
         temp_v = self.extend_to(common_qvar)
-        temp_m = vmat.extend_to(common_qvar)
-        new_v = temp_m.mat @ temp_v.vec
-        return VVec(common_qvar, new_v)
+        axes = common_qvar.perm_idx_to(vmat.qvar)
+
+        new_v = tensor_apply(temp_v.vec.reshape((2,)*len(common_qvar)), vmat.mat, axes)
+        return VVec(common_qvar, new_v.reshape((-1,)))
     
     def norm_vec(self) -> VVec:
         '''
@@ -230,9 +265,15 @@ class VMat(VTerm):
         if not isinstance(other, VMat):
             return False
         
+        # no extension for the same qvar
+        if self.qvar.ls == other.qvar.ls:
+            return np.max(np.abs(self.mat - other.mat)) < self.eps
         return np.max(np.abs((self-other).mat)) < self.eps
 
     def transform_to(self, tgt_qvar: QVar) -> VMat:
+        if tgt_qvar is self.qvar or tgt_qvar == self.qvar:
+            return self
+
         qvar_perm = list(self.qvar.perm_idx_to(tgt_qvar))
 
         # generate the new perm
@@ -320,11 +361,37 @@ class VMat(VTerm):
         eig_vals = np.linalg.eigvals(diff)
         return bool(np.min(eig_vals) > -self.eps)
     
+    def Oapply(self, vmat : VMat) -> VMat:
+        '''
+            return vmat * self * vmat^dagger, in the qvar order of current vmat.
+            The operator is contracted onto the row and column axes of its qubits only.
+        '''
+        common_qvar = self.qvar + vmat.qvar
+        temp_m = self.extend_to(common_qvar)
+        return VMat(common_qvar, self._conj_apply(temp_m.mat, common_qvar, vmat))
+    
+    @staticmethod
+    def _conj_apply(mat : np.ndarray, qvar : QVar, vmat : VMat) -> np.ndarray:
+        '''
+            calculate vmat * mat * vmat^dagger for [mat] on [qvar], which should contain vmat.qvar
+        '''
+        n = len(qvar)
+        axes = qvar.perm_idx_to(vmat.qvar)
+        new_m = mat.reshape((2,)*2*n)
+        new_m = tensor_apply(new_m, vmat.mat, axes)
+        new_m = tensor_apply(new_m, vmat.mat.conj(), tuple(i + n for i in axes))
+        return new_m.reshape((2**n, 2**n))
+    
     def SOapply(self, vso : VSuperOpt) -> VMat:
-        opt_sum = VMat.zeroMat()
+        common_qvar = self.qvar
+        for vopt in vso.ls:
+            common_qvar = common_qvar + vopt.qvar
+        temp_m = self.extend_to(common_qvar)
+
+        opt_sum = np.zeros(temp_m.mat.shape, dtype = complex)
         for vopt in vso.ls:
-            opt_sum = opt_sum + vopt.mul(self, False).mul(vopt.dagger())
-        return opt_sum
+            opt_sum = opt_sum + self._conj_apply(temp_m.mat, common_qvar, vopt)
+        return VMat(common_qvar, opt_sum)
 
 
 
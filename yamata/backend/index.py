@@ -0,0 +1,158 @@
+'''
+    Index of quantum terms for finding the equal ones (within eps) quickly.
+'''
+
+from __future__ import annotations
+from typing import List, Tuple, Dict, Any, Iterator, Callable
+
+import numpy as np
+
+from .backend import *
+
+
+class VTermIndex:
+    '''
+    An index of VVec/VMat terms with values attached, for finding a term equal 
+    (within the tolerance) to a given one in O(1) on average.
+
+    Terms are grouped by the sorted qvar. In a group, a term is put in the bucket of its
+    fingerprint, which is a fixed random weighting of the entries of the term in the canonical
+    (sorted) qvar order. For vectors, the fingerprint uses the squared amplitudes and therefore
+    does not depend on the global phase. For every query, the fingerprints of all the terms within
+    the tolerance are in a range computed from the query, and only the buckets in this range 
+    (usually one or two neighbours) are checked with the exact comparison.
+    '''
+
+    # weights of the fingerprint for every dimension, shared by all indices
+    _weights : Dict[int, np.ndarray] = {}
+
+    def __init__(self, tol : float = VTerm.eps_value):
+        self.tol = tol
+
+        # group key -> bucket number -> list of (term, value)
+        self._groups : Dict[Tuple[str, ...], Dict[int, List[Tuple[VTerm, Any]]]] = {}
+        self._width : Dict[Tuple[str, ...], float] = {}
+        self._sorted : Dict[Tuple[str, ...], QVar] = {}
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+    
+    def items(self) -> Iterator[Tuple[VTerm, Any]]:
+        for group in self._groups.values():
+            for bucket in group.values():
+                for item in bucket:
+                    yield item
+
+    @staticmethod
+    def weights(dim : int) -> np.ndarray:
+        w = VTermIndex._weights.get(dim)
+        if w is None:
+            w = np.random.default_rng(dim).random(dim)
+            VTermIndex._weights[dim] = w
+        return w
+    
+    def canonical(self, term : VTerm) -> VTerm:
+        '''
+            return the term in the sorted qvar order
+        '''
+        key = tuple(term.qvar.ls)
+        qvar = self._sorted.get(key)
+        if qvar is None:
+            qvar = QVar(sorted(key))
+            self._sorted[key] = qvar
+        return term.transform_to(qvar)
+
+    def fingerprint(self, term : VTerm) -> Tuple[float, float]:
+        '''
+            return the fingerprint of the (canonical) term, and the bound of the difference 
+            between it and the fingerprint of any term within the tolerance
+        '''
+        if isinstance(term, VVec):
+            dim = len(term.vec)
+            amp = np.abs(term.vec)
+            f = float(np.dot(self.weights(dim), amp * amp))
+            # ||a|^2 - |b|^2| <= tol * (2|a| + tol) for every entry
+            bound = self.tol * (2 * float(np.sum(amp)) + dim * self.tol)
+
+        elif isinstance(term, VMat):
+            dim = term.mat.shape[0]
+            entry = term.mat.reshape(-1)
+            w = self.weights(dim * dim)
+            f = float(np.dot(w, np.real(entry)) + np.dot(w, np.imag(entry)))
+            # both the real and imaginary parts differ by less than tol for every entry
+            bound = 2 * self.tol * dim * dim
+
+        else:
+            raise Exception()
+        
+        return f, bound
+    
+    def close(self, a : VTerm, b : VTerm) -> bool:
+        '''
+            whether the two terms are equal within the tolerance
+        '''
+        if isinstance(a, VVec) and isinstance(b, VVec):
+            # the terms in a group are on the same qvar, and compared without extension
+            if a.qvar.ls == b.qvar.ls:
+                return bool(np.max(np.abs(a.vec - b.vec)) < self.tol)
+            return bool(np.max(np.abs((a - b).vec)) < self.tol)
+        if isinstance(a, VMat) and isinstance(b, VMat):
+            if a.qvar.ls == b.qvar.ls:
+                return bool(np.max(np.abs(a.mat - b.mat)) < self.tol)
+            return bool(np.max(np.abs((a - b).mat)) < self.tol)
+        return False
+    
+    def _buckets(self, key : Tuple[str, ...], f : float, bound : float) -> range:
+        width = self._width[key]
+        return range(int(np.floor((f - bound) / width)), int(np.floor((f + bound) / width)) + 1)
+    
+    def find(self, term : VTerm, accept : Callable[[VTerm, Any], bool] | None = None) -> Any:
+        '''
+            return the value of a term equal to [term] within the tolerance, or None if not found
+            accept : if designated, only the (term, value) it accepts are returned
+        '''
+        term = self.canonical(term)
+        key = tuple(term.qvar.ls)
+
+        group = self._groups.get(key)
+        if group is not None:
+            f, bound = self.fingerprint(term)
+            for b in self._buckets(key, f, bound):
+                for item in group.get(b, ()):
+                    if self.close(term, item[0]) and (accept is None or accept(*item)):
+                        return item[1]
+
+        # terms on other qvars can still be equal by extension
+        for other_key, other_group in self._groups.items():
+            if other_key == key:
+                continue
+            for bucket in other_group.values():
+                for item in bucket:
+                    if self.close(term, item[0]) and (accept is None or accept(*item)):
+                        return item[1]
+                    
+        return None
+
+    def add(self, term : VTerm, value : Any) -> None:
+        '''
+            add the term with its value to the index (no check of existence)
+        '''
+        term = self.canonical(term)
+        key = tuple(term.qvar.ls)
+
+        f, bound = self.fingerprint(term)
+        if key not in self._groups:
+            self._groups[key] = {}
+            # the buckets are about as wide as the bound for normalized terms, 
+            # so that usually only neighbours are probed
+            dim = 2**term.qnum
+            if isinstance(term, VVec):
+                width = self.tol * (2 * np.sqrt(dim) + dim * self.tol)
+            else:
+                width = 2 * self.tol * dim * dim
+            self._width[key] = max(width, 1e-12)
+
+        b = int(np.floor(f / self._width[key]))
+        self._groups[key].setdefault(b, []).append((term, value))
+        self._len += 1
@@ -2,14 +2,16 @@ from __future__ import annotations
 from typing import List, Type, Tuple
 
 import random
+import numpy as np
 
 from .backend import VTerm
 
 
 
-def sampling(prob : List[float]) -> int:
+def sampling(prob : List[float], rng : np.random.Generator | None = None) -> int:
     '''
         Do a sampling according to the probability distribution given by prob.
+        rng : the random generator to use. The global one in [random] is used if not designated.
         return the sample result, in number
         if -1 is returned, it means the sample result falls into the ''otherwise'' situation,
             (probability sums to less than 1)
@@ -19,7 +21,7 @@ def sampling(prob : List[float]) -> int:
         raise ValueError("Invalid probabilistic distribution.")
 
     # get random number
-    r = random.random()
+    r = random.random() if rng is None else rng.random()
 
     # compare it with the cumulative distribution sum
     s = 0.
@@ -30,6 +32,26 @@ def sampling(prob : List[float]) -> int:
         
     return -1
 
+
+def sampling_batch(prob : np.ndarray, rng : np.random.Generator) -> np.ndarray:
+    '''
+        Do a sampling for every column of prob, which has the shape (outcomes, batch).
+        return the array of sample results, where -1 means the ''otherwise'' situation,
+            as in [sampling].
+    '''
+    # check the distributions
+    if prob.size > 0 and (np.max(np.sum(prob, axis = 0)) > 1. + VTerm.eps_value 
+                          or np.min(prob) < - VTerm.eps_value):
+        raise ValueError("Invalid probabilistic distribution.")
+    
+    # compare the random numbers with the cumulative distribution sums
+    r = rng.random(prob.shape[1])
+    below = r < np.cumsum(prob, axis = 0)
+
+    res = np.argmax(below, axis = 0)
+    res[~np.any(below, axis = 0)] = -1
+    return res
+
     
 
 
@@ -0,0 +1,165 @@
+'''
+    The persistent cache of compiled flowcharts.
+
+    Entries are content-addressed by the source code, the fingerprint of the operator library
+    and the compilation options. Every entry is one file in the cache directory holding the flat 
+    state of the flowchart (see Flowchart.__getstate__): the table of syntax tree nodes, the 
+    vertices, and the typed edges referring to the operators by name. The operator library 
+    itself is not stored, but attached again when the entry is loaded.
+
+    The files are pickles, so the cache directory should only be writable by trusted users.
+'''
+
+from __future__ import annotations
+from typing import Dict, Tuple, Any
+
+import os
+import pickle
+import hashlib
+
+import numpy as np
+
+from .backend import OptEnv
+from .flowchart.flowchart import Flowchart
+
+# increased whenever the stored format changes, so that older entries are not used
+CACHE_FORMAT = 1
+
+def default_cache_dir() -> str:
+    return os.environ.get("YAMATA_CACHE_DIR", 
+                          os.path.join(os.path.expanduser("~"), ".cache", "yamata"))
+
+
+def optlib_fingerprint(optlib : OptEnv) -> str:
+    '''
+        the sha256 digest of all the operators in [optlib], with their names
+    '''
+    h = hashlib.sha256()
+    for kind, opts in (("unitary", optlib.unitary_opt), ("measure", optlib.measure_opt)):
+        for name in sorted(opts):
+            mat = np.ascontiguousarray(opts[name], dtype = complex)
+            h.update(repr((kind, name, mat.shape)).encode())
+            h.update(mat.tobytes())
+    return h.hexdigest()
+
+
+class CompileCache:
+    '''
+        The directory [path] of cached flowcharts, keeping at most [max_bytes] bytes.
+        The least recently used entries (by the modification times of the files, which are 
+        updated on every hit) are evicted first.
+    '''
+    def __init__(self, path : str | None = None, max_bytes : int = 256 * 2**20):
+        self.path = default_cache_dir() if path is None else path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok = True)
+
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, code : str, optlib : OptEnv, options : Dict[str, Any] | None = None) -> str:
+        '''
+            the key of the compilation of [code] with [optlib] and the options which affect 
+            the flowchart
+        '''
+        options = options or {}
+        h = hashlib.sha256()
+        h.update(repr((CACHE_FORMAT, sorted(options.items()))).encode())
+        h.update(optlib_fingerprint(optlib).encode())
+        h.update(code.encode())
+        return h.hexdigest()
+    
+    def file(self, key : str) -> str:
+        return os.path.join(self.path, key + ".fc")
+    
+    def get(self, key : str, optlib : OptEnv) -> Flowchart | None:
+        '''
+            the cached flowchart with the operator library attached, or None
+        '''
+        try:
+            with open(self.file(key), "rb") as f:
+                cls, state = pickle.load(f)
+            fc = cls.__new__(cls)
+            fc.__setstate__(state)
+        except OSError:
+            self.misses += 1
+            return None
+        except Exception:
+            # a broken entry, or one written by another version of the classes 
+            # (AttributeError, ImportError, TypeError ... when unpickled) : remove it
+            try:
+                os.remove(self.file(key))
+            except OSError:
+                pass
+            self.misses += 1
+            return None
+        
+        # mark as recently used
+        try:
+            os.utime(self.file(key))
+        except OSError:
+            pass
+        
+        fc._optlib = optlib
+        self.hits += 1
+        return fc
+    
+    def put(self, key : str, fc : Flowchart) -> None:
+        '''
+            store the flowchart, and evict the old entries beyond the size bound
+        '''
+        state = fc.__getstate__()
+        state['_optlib'] = None
+
+        # write to a temporary file first, so that readers never see partial entries
+        import tempfile
+        fd, tmp = tempfile.mkstemp(dir = self.path, suffix = ".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((type(fc), state), f, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.file(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        self.evict()
+
+    def entries(self) -> Dict[str, Tuple[float, int]]:
+        '''
+            file name -> (last use time, size) for all the entries
+        '''
+        r = {}
+        for name in os.listdir(self.path):
+            if name.endswith(".fc"):
+                try:
+                    st = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                r[name] = (st.st_mtime, st.st_size)
+        return r
+    
+    def size(self) -> int:
+        return sum(size for _, size in self.entries().values())
+    
+    def evict(self) -> None:
+        '''
+            remove the least recently used entries until the total size is within the bound
+        '''
+        entries = self.entries()
+        total = sum(size for _, size in entries.values())
+        for name in sorted(entries, key = lambda name : entries[name][0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            total -= entries[name][1]
+
+    def clear(self) -> None:
+        for name in self.entries():
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
@@ -8,22 +8,68 @@
 
 
 from __future__ import annotations
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Callable
+from collections import deque
 
-from .qparsing.vparser import parser
 from .flowchart.flowchart import Flowchart, Vertex
 
-from .backend import OptEnv, get_optlib
+from .backend import OptEnv, QVar, get_optlib
+from .cache import CompileCache
 
 from .qast import *
-from copy import deepcopy
 
 
-def next(ast : AstStatement) -> List[Tuple[AstStatement|AstVOpt|None, AstStatement]]:
+def ample_component(ast : AstParallel) -> int | None:
+    '''
+        Partial order reduction: return the position of the component to be scheduled alone, 
+        or None if all the components should be interleaved.
+
+        The component should begin with a unitary, an initialization or skip, no other 
+        component may act on its qubits, and no component may abort. Then its steps commute 
+        with all the others, and scheduling it first keeps both the terminal states of qtscalc 
+        and their distribution under the uniform random scheduler of vecsim. An abort stops 
+        the program with the steps taken so far by all the components, which depend on the 
+        interleaving, so no reduction is made then.
+        Note that the step counts may change: the scheduling steps of a parallel composition 
+        are only taken while two or more components remain, and their number depends on the
+        interleaving. So do the results truncated by a step bound.
+    '''
+    if any(ABORT_FOOTPRINT in c.footprint() for c in ast.ls):
+        return None
+    
+    for i in range(len(ast.ls)):
+        if not isinstance(ast.ls[i].first(), (AstUnitary, AstInit, AstSkip)):
+            continue
+
+        qubits = ast.ls[i].footprint()
+        if all(qubits.isdisjoint(ast.ls[j].footprint()) for j in range(len(ast.ls)) if j != i):
+            return i
+    return None
+
+
+def symmetric_canonical(ast : AstStatement) -> AstStatement:
+    '''
+        Symmetry reduction: the program with all the parallel compositions in it replaced by 
+        their canonical forms (see AstParallel.canonical).
+        Configurations that only differ in the order of the components become the same vertex, 
+        and the transitions of identical components remain separate edges to it.
+    '''
+    table, roots = ast_flatten([ast])
+    table = [(canonical_parallel if ctor is AstParallel else ctor, args) for ctor, args in table]
+    return ast_unflatten(table)[roots[0]]  # type: ignore
+
+def canonical_parallel(ls : Tuple[AstStatement, ...]) -> AstParallel:
+    return AstParallel(ls).canonical()
+
+
+def next(ast : AstStatement, por : bool = False, symmetry : bool = False) -> List[Tuple[AstStatement|AstVOpt|None, AstStatement]]:
     '''
         return the abstract syntax tree for the next step.
         result: a tuple, first element is the transformation, 
             and the second element is the next program syntax
+        por : whether to apply the partial order reduction (see ample_component)
+        symmetry : whether to apply the symmetry reduction (see symmetric_canonical), 
+            which expects [ast] in the canonical form
     '''
     if isinstance(ast, AstTerminal):
         return []
@@ -48,7 +94,7 @@ def next(ast : AstStatement) -> List[Tuple[AstStatement|AstVOpt|None, AstStateme
     
     elif isinstance(ast, AstSeq):
         # case on S0
-        next_S0_ls = next(ast.S0)
+        next_S0_ls = next(ast.S0, por, symmetry)
         next_seq : List[Tuple[AstStatement|AstVOpt|None, AstStatement]] = []
         for next_pair in next_S0_ls:
             if isinstance(next_pair[1], AstTerminal):
@@ -59,31 +105,35 @@ def next(ast : AstStatement) -> List[Tuple[AstStatement|AstVOpt|None, AstStateme
     
     elif isinstance(ast, AstParallel):
         next_para : List[Tuple[AstStatement|AstVOpt|None, AstStatement]] = []
-        for i in range(len(ast.ls)):
+        indices = range(len(ast.ls))
+        if por:
+            ample = ample_component(ast)
+            if ample is not None:
+                indices = range(ample, ample + 1)
+
+        def replaced(i : int, prog : AstStatement) -> AstParallel:
+            r = ast.replaced(i, prog)
+            return r.canonical() if symmetry else r
+
+        for i in indices:
             ast_i = ast.ls[i]
             if isinstance(ast_i, AstAtom):
                 next_para.append((None, AstSeq(ast_i.prog, ast.remove(i))))
 
             elif isinstance(ast_i, AstLoop):
-                new_para = ast.ls.copy()
-                new_para[i] = AstSeq(ast_i.body, ast_i)
-                next_para.append((None, AstParallel(new_para)))
+                next_para.append((None, replaced(i, AstSeq(ast_i.body, ast_i))))
 
             elif isinstance(ast_i, AstIf):
                 # process every guarded command
-                new_guarded = deepcopy(ast_i.ls)
-                for j in range(len(ast_i.ls)):
-                    new_para = ast.ls.copy()
-                    new_para[i] = ast_i.ls[j].prog
-                    new_guarded[j].prog = AstParallel(new_para)
+                new_guarded = []
+                for guard in ast_i.ls:
+                    new_guarded.append(AstGuardedProg(guard.vopt, replaced(i, guard.prog)))
                 
                 next_para.append((None, AstIf(new_guarded)))
 
             elif isinstance(ast_i, AstWhile):
                 # expand while to a if statement
-                new_para = ast.ls.copy()
-                new_para[i] = AstSeq(ast_i.body.prog, ast_i)
-                new_guarded = [AstGuardedProg(ast_i.body.vopt, AstParallel(new_para))]
+                new_guarded = [AstGuardedProg(ast_i.body.vopt, replaced(i, AstSeq(ast_i.body.prog, ast_i)))]
 
                 # else branch
                 new_guarded.append(AstGuardedProg(ast_i.term_vopt, ast.remove(i)))
@@ -92,44 +142,32 @@ def next(ast : AstStatement) -> List[Tuple[AstStatement|AstVOpt|None, AstStateme
             elif isinstance(ast_i, AstSeq):
                 # match S0
                 if isinstance(ast_i.S0, AstAtom):
-                    new_para = ast.ls.copy()
-                    new_para[i] = ast_i.S1
-                    next_para.append((None, AstSeq(ast_i.S0.prog, AstParallel(new_para))))
+                    next_para.append((None, AstSeq(ast_i.S0.prog, replaced(i, ast_i.S1))))
 
                 elif isinstance(ast_i.S0, AstLoop):
-                    new_para = ast.ls.copy()
-                    new_para[i] = AstSeq(ast_i.S0.body, ast_i)
-                    next_para.append((None, AstParallel(new_para)))
+                    next_para.append((None, replaced(i, AstSeq(ast_i.S0.body, ast_i))))
 
                 elif isinstance(ast_i.S0, AstIf):
                     # process every guarded command
-                    new_guarded = deepcopy(ast_i.S0.ls)
-                    for j in range(len(ast_i.S0.ls)):
-                        new_para = ast.ls.copy()
+                    new_guarded = []
+                    for guard in ast_i.S0.ls:
                         # sequential composition here
-                        new_para[i] = AstSeq(ast_i.S0.ls[j].prog, ast_i.S1)
-                        new_guarded[j].prog = AstParallel(new_para)
+                        new_guarded.append(AstGuardedProg(guard.vopt, replaced(i, AstSeq(guard.prog, ast_i.S1))))
                     
                     next_para.append((None, AstIf(new_guarded)))
                 
                 elif isinstance(ast_i.S0, AstWhile):
                     # expand while to a if statement
-                    new_para = ast.ls.copy()
                     # sequential composition here
-                    new_para[i] = AstSeq(ast_i.S0.body.prog, ast_i)
-                    new_guarded = [AstGuardedProg(ast_i.S0.body.vopt, AstParallel(new_para))]
+                    new_guarded = [AstGuardedProg(ast_i.S0.body.vopt, replaced(i, AstSeq(ast_i.S0.body.prog, ast_i)))]
 
                     # else branch
-                    new_para = ast.ls.copy()
-                    new_para[i] = ast_i.S1
-                    new_guarded.append(AstGuardedProg(ast_i.S0.term_vopt, AstParallel(new_para)))
+                    new_guarded.append(AstGuardedProg(ast_i.S0.term_vopt, replaced(i, ast_i.S1)))
                     next_para.append((None, AstIf(new_guarded)))
 
                 elif isinstance(ast_i.S0, AstSkip) or isinstance(ast_i.S0, AstAbort)\
                     or isinstance(ast_i.S0, AstInit) or isinstance(ast_i.S0, AstUnitary):
-                    new_para = ast.ls.copy()
-                    new_para[i] = ast_i.S1
-                    next_para.append((None, AstSeq(ast_i.S0, AstParallel(new_para))))
+                    next_para.append((None, AstSeq(ast_i.S0, replaced(i, ast_i.S1))))
 
                 else:
                     raise Exception()
@@ -149,49 +187,218 @@ def next(ast : AstStatement) -> List[Tuple[AstStatement|AstVOpt|None, AstStateme
         raise Exception()
 
 
-def compile_fc(ast : AstStatement) -> Flowchart:
+class CompileAbort(Exception):
+    '''
+        Raised when the construction of a flowchart exceeds its budget, or is stopped by the 
+        progress callback. The partial flowchart is kept in [fc].
+    '''
+    def __init__(self, msg : str, fc : Flowchart):
+        super().__init__(msg)
+        self.fc = fc
+
+
+def compile_fc(ast : AstStatement, order : str = "dfs", 
+               max_vertices : int | None = None, max_edges : int | None = None,
+               progress : Callable[[int, int], bool | None] | None = None, 
+               progress_interval : int = 1000, por : bool = False, symmetry : bool = False) -> Flowchart:
+    '''
+        Construct the flowchart of the reachable configurations from [ast].
+
+        order : "dfs" or "bfs", the order to explore the configurations. 
+            "dfs" numbers the vertices in the preorder of the successors.
+        max_vertices, max_edges : the budget of the flowchart, CompileAbort is raised when exceeded.
+        progress : called with the numbers of vertices and edges every [progress_interval] 
+            new vertices. Returning False stops the construction with CompileAbort.
+        por : whether to apply the partial order reduction (see ample_component)
+        symmetry : whether to apply the symmetry reduction (see symmetric_canonical)
+    '''
+    if symmetry:
+        ast = symmetric_canonical(ast)
     fc = Flowchart()
     v = fc.createV(ast)
-    extend_fc(fc, v)
+    extend_fc(fc, v, order, max_vertices, max_edges, progress, progress_interval, por, symmetry)
     return fc
 
-def extend_fc(fc : Flowchart, v : Vertex):
+def extend_fc(fc : Flowchart, v : Vertex, order : str = "dfs", 
+              max_vertices : int | None = None, max_edges : int | None = None,
+              progress : Callable[[int, int], bool | None] | None = None, 
+              progress_interval : int = 1000, por : bool = False, symmetry : bool = False) -> None:
     '''
        This method is invocated only when [fc] contains [ast].
+       The reachable configurations are explored with an explicit worklist (see compile_fc).
     '''
-    next_pairs = next(v.label)
-    for pair in next_pairs:
-        # if [fc] does not contain the next vertex [u] yet
-        u = fc.findV(pair[1])
-        if u is None:
-            u = fc.createV(pair[1])
-            extend_fc(fc, u)
 
-        fc.createE(pair[0], v, u)
+    def new_vertex(label : AstStatement) -> Vertex:
+        if max_vertices is not None and len(fc.vertices) >= max_vertices:
+            raise CompileAbort("The flowchart exceeds the budget of " + str(max_vertices) + " vertices.", fc)
+        u = fc.createV(label)
+        if progress is not None and len(fc.vertices) % progress_interval == 0:
+            if progress(len(fc.vertices), len(fc.edges)) is False:
+                raise CompileAbort("The compilation is stopped at " + str(len(fc.vertices)) + " vertices.", fc)
+        return u
+
+    def new_edge(branch : AstStatement | AstVOpt | None, vA : Vertex, vB : Vertex) -> None:
+        if max_edges is not None and len(fc.edges) >= max_edges:
+            raise CompileAbort("The flowchart exceeds the budget of " + str(max_edges) + " edges.", fc)
+        fc.createE(branch, vA, vB)
+
+    if order == "dfs":
+        # the frames [vertex, next pairs, position]
+        # The pair at the position is visited again after the new vertex is extended, 
+        # so that the edge is created after the extension, as the recursive definition does.
+        stack : List[List] = [[v, next(v.label, por, symmetry), 0]]
+        while len(stack) > 0:
+            frame = stack[-1]
+            v, next_pairs, i = frame
+            if i == len(next_pairs):
+                stack.pop()
+                continue
+
+            # if [fc] does not contain the next vertex [u] yet
+            u = fc.findV(next_pairs[i][1])
+            if u is None:
+                u = new_vertex(next_pairs[i][1])
+                stack.append([u, next(u.label, por, symmetry), 0])
+                continue
+
+            new_edge(next_pairs[i][0], v, u)
+            frame[2] = i + 1
+
+    elif order == "bfs":
+        queue = deque([v])
+        while len(queue) > 0:
+            v = queue.popleft()
+            for pair in next(v.label, por, symmetry):
+                u = fc.findV(pair[1])
+                if u is None:
+                    u = new_vertex(pair[1])
+                    queue.append(u)
+
+                new_edge(pair[0], v, u)
+
+    else:
+        raise ValueError("Unknown exploration order '" + order + "'.")
                 
 
 
 
+class LazyFlowchart(Flowchart):
+    '''
+        The flowchart whose vertices are expanded on demand. The out-edges of a vertex (and the
+        new vertices they lead to) are constructed by [next] when the vertex is reached for the 
+        first time (see Flowchart.expand), and checked with the operator library at the same 
+        moment. Expanded vertices are kept, so they are reused by all later calculations.
+    '''
+    def __init__(self, ast : AstStatement, optlib : OptEnv, por : bool = False, symmetry : bool = False):
+        super().__init__()
+        self.por = por
+        self.symmetry = symmetry
+        self._expanded : List[bool] = []
+        self._optlib = optlib
+
+        if symmetry:
+            ast = symmetric_canonical(ast)
+        self.createV(ast)
+
+    @property
+    def register(self) -> QVar:
+        '''
+            All the qubits of the program, in the order of first appearance in the syntax tree, 
+            since the edges are not all known.
+        '''
+        if self._register is None:
+            ls : List[str] = []
+            table, _ = ast_flatten([self.vertices[0].label])
+            for ctor, args in table:
+                if ctor is AstQVar:
+                    for q in args[0]:
+                        if q not in ls:
+                            ls.append(q)
+            self._register = QVar(ls)
+
+        return self._register
+    
+    def __getstate__(self) -> Dict:
+        state = super().__getstate__()
+        state.update({'por' : self.por, 'symmetry' : self.symmetry, '_expanded' : self._expanded})
+        return state
+    
+    def __setstate__(self, state : Dict) -> None:
+        super().__setstate__(state)
+        self.por = state['por']
+        self.symmetry = state['symmetry']
+        self._expanded = state['_expanded']
+
+    def createV(self, label : AstStatement) -> Vertex:
+        v = super().createV(label)
+        self._expanded.append(False)
+        return v
+    
+    def expanded(self, v : Vertex) -> bool:
+        return self._expanded[v.id]
+    
+    def expand(self, v : Vertex) -> None:
+        if self._expanded[v.id]:
+            return
+        
+        start = len(self.edges)
+        for pair in next(v.label, self.por, self.symmetry):
+            u = self.findV(pair[1])
+            if u is None:
+                u = self.createV(pair[1])
+            self.createE(pair[0], v, u)
+        self._expanded[v.id] = True
+
+        # semantic check with operator library
+        for e in self.edges[start:]:
+            e.semantic_check(self.optlib)
+        v.semantic_check(self.optlib)
+
+
 ######################################################
 # interface
 
-def compile(code : str, optlib : OptEnv | None = None) -> Flowchart:
+def compile(code : str, optlib : OptEnv | None = None, order : str = "dfs", 
+            max_vertices : int | None = None, max_edges : int | None = None,
+            progress : Callable[[int, int], bool | None] | None = None, 
+            progress_interval : int = 1000, por : bool = False, symmetry : bool = False,
+            lazy : bool = False, cache : CompileCache | None = None) -> Flowchart:
     '''
         compile the code string to a flowchart.
         output_path : whether to output the diagram
         show_prog : will replace program codes with vertex numbers if set to False
+        order, max_vertices, max_edges, progress, progress_interval, por, symmetry : see compile_fc
+        lazy : return a LazyFlowchart, which is expanded by the calculations on demand
+            (the exploration options and the cache do not apply then)
+        cache : the cache of compiled flowcharts. On a hit, parsing, compilation and the 
+            semantic check are all skipped.
     '''
 
     if optlib is None:
         optlib = get_optlib()
 
-    ast = parser.parse(code)
+    key = None
+    if cache is not None and not lazy:
+        key = cache.key(code, optlib, {'order' : order, 'por' : por, 'symmetry' : symmetry})
+        fc = cache.get(key, optlib)
+        if fc is not None:
+            return fc
+
+    # the parser is imported on demand, so that cache hits do not load it
+    from .qparsing.vparser import get_parser
+    ast = get_parser().parse(code)
+
+    if lazy:
+        return LazyFlowchart(ast, optlib, por, symmetry)
 
     # compile abstract syntax tree to flowchart
-    fc = compile_fc(ast)
+    fc = compile_fc(ast, order, max_vertices, max_edges, progress, progress_interval, por, symmetry)
 
     # flowchart: semantic check with operator library
     fc.semantic_check(optlib)
 
+    if cache is not None and key is not None:
+        cache.put(key, fc)
+
     return fc
     
\ No newline at end of file
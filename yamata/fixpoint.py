@@ -0,0 +1,216 @@
+'''
+    The fixpoint calculation of the limit semantics, without the step bound.
+
+    The semantics is linear in the input state, so that it is calculated on the states of the 
+    normalized density operators (trace 1) at the vertices, reachable from the initial one. For 
+    every state, the result is the flat set of output density operators, as in qtscalc_reduced :
+        terminal vertex : {rho},
+        abort (or a branch of zero trace) : {0},
+        one branch of trace t to the state s : t * sem(s),
+        the combination of the branches : the union (QtsNondet) or the sums (QtsProb).
+    The strongly connected components of the states are solved in topological order (the 
+    successors first). The components with cycles (the loops) are solved by Kleene iteration 
+    from {0}, until successive iterates agree within the tolerance, and the other states are 
+    calculated once. The result is the limit of qtscalc(..., reduce = True) as the step bound 
+    grows. The reachable states should be finite, as for the measurements in the computational 
+    basis, and the sets can be large for the nondeterministic choices inside the loops.
+'''
+
+from __future__ import annotations
+from typing import List, Dict, Tuple
+
+import importlib
+
+import numpy as np
+
+from .backend import *
+from .flowchart.flowchart import *
+from .qtscalc import QtsRho, QtsNondet
+
+# the steps are taken through the module, so that the profiler also records them
+# (the package attribute [qtscalc] is the function of the same name)
+qtscalc_module = importlib.import_module(".qtscalc", __package__)
+
+
+class FixpointRes:
+    '''
+    The result of the fixpoint calculation.
+        qts : the reduced quantum tree state in the limit
+        states : the number of reachable states (vertex, normalized density operator)
+        iterations : the total number of Kleene iterations of the components with cycles
+        converged : whether all the components converged within the maximum iterations
+    '''
+    def __init__(self, _qts : QtsRho | QtsNondet, _states : int, _iterations : int, _converged : bool):
+        self.qts = _qts
+        self.states = _states
+        self.iterations = _iterations
+        self.converged = _converged
+
+    def __str__(self) -> str:
+        return "fixpoint: %d states, %d iterations%s" \
+            % (self.states, self.iterations, "" if self.converged else " (not converged)")
+
+
+def scc_order(succ : List[List[int]]) -> List[List[int]]:
+    '''
+        the strongly connected components of the graph of successor lists, in the topological 
+        order of the successors first (Tarjan's algorithm, without recursion)
+    '''
+    index : Dict[int, int] = {}
+    low : Dict[int, int] = {}
+    on_stack = set()
+    stack : List[int] = []
+    sccs : List[List[int]] = []
+
+    for root in range(len(succ)):
+        if root in index:
+            continue
+        # frames of (node, the next successor)
+        frames = [(root, 0)]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while len(frames) > 0:
+            u, i = frames[-1]
+            if i < len(succ[u]):
+                frames[-1] = (u, i + 1)
+                w = succ[u][i]
+                if w not in index:
+                    index[w] = low[w] = len(index)
+                    stack.append(w)
+                    on_stack.add(w)
+                    frames.append((w, 0))
+                elif w in on_stack:
+                    low[u] = min(low[u], index[w])
+                continue
+
+            frames.pop()
+            if len(frames) > 0:
+                parent = frames[-1][0]
+                low[parent] = min(low[parent], low[u])
+            if low[u] == index[u]:
+                scc : List[int] = []
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(w)
+                    scc.append(w)
+                    if w == u:
+                        break
+                sccs.append(scc)
+    return sccs
+
+
+def rho_close(a : List[VMat], b : List[VMat], radius : float) -> bool:
+    '''
+        whether every density operator of the two lists is within the trace distance [radius] 
+        of one in the other list, by the bound and through a VTermIndex as in rho_merge
+    '''
+    dim = max(rho.mat.shape[0] for rho in a + b)
+    def dist(a : VMat, b : VMat) -> float:
+        return float(np.sqrt(dim) * np.linalg.norm((a - b).mat))
+
+    def covered(ls : List[VMat], by : List[VMat]) -> bool:
+        index = VTermIndex(radius / np.sqrt(dim) + VTerm.eps_value)
+        for rho in by:
+            index.add(rho, rho)
+        return all(index.find(rho, lambda res, _ : dist(rho, res) <= radius) is not None for rho in ls)
+    return covered(a, b) and covered(b, a)
+
+
+def fixpoint(fc : Flowchart, rhoinit : VMat, eps = 1e-8, max_iterations = 1000, 
+             max_states = 100000) -> FixpointRes:
+    '''
+        calculate the limit semantics of the flowchart on [rhoinit] by Kleene iteration
+        eps : the tolerance in trace distance of the convergence, within which the results in 
+            the components with cycles are also merged
+        max_iterations : the maximum number of iterations of every component
+        max_states : the maximum number of reachable states, beyond which the states are 
+            considered infinite and ValueError is raised
+    '''
+    if not (VMat.zeroMat() <= rhoinit) or np.real(rhoinit.trace()) > 1 + rhoinit.eps:
+        raise ValueError("Invalid partial density operator.")
+    
+    Res = Tuple[bool, List[VMat]]
+    bottom : Res = (True, [VMat.zeroMat()])
+    reg = rhoinit.qvar + fc.register
+    rho = rhoinit.extend_to(reg)
+    trace = np.real(rho.trace())
+    if trace < rho.eps:
+        return FixpointRes(QtsRho(bottom[1][0]), 0, 0, True)
+
+    # the states (vertex, normalized rho), numbered through an index for every vertex
+    indexes : Dict[int, VTermIndex] = {}
+    states : List[Tuple[Vertex, VMat]] = []
+    def state_id(v : Vertex, rho : VMat) -> int:
+        index = indexes.setdefault(v.id, VTermIndex())
+        i = index.find(rho)
+        if i is None:
+            if len(states) == max_states:
+                raise ValueError("More than " + str(max_states) + " reachable states.")
+            i = len(states)
+            states.append((v, rho))
+            index.add(rho, i)
+        return i
+
+    # the combinator and the branches of every state, as (state id or None for zero, trace)
+    branches : List[Tuple[type | None, List[Tuple[int | None, float]]]] = []
+    state_id(fc.vertices[0], VMat(reg, rho.mat / trace))
+    while len(branches) < len(states):
+        v, rho = states[len(branches)]
+        if isinstance(v, TVertex):
+            branches.append((None, []))
+            continue
+        fc.expand(v)
+        comb, ls = qtscalc_module.rho_branches(v, rho, fc.optlib)
+        sub_ls : List[Tuple[int | None, float]] = []
+        for w, sub in ls:
+            t = np.real(sub.trace())
+            sub_ls.append((None, 0.) if t < sub.eps else (state_id(w, VMat(sub.qvar, sub.mat / t)), t))
+        branches.append((comb, sub_ls))
+
+    sem : Dict[int, Res] = {}
+    def step(i : int) -> Res:
+        '''
+            the result of the state [i] from the current ones of its successors
+        '''
+        v, rho = states[i]
+        if isinstance(v, TVertex):
+            return True, [rho]
+        comb, sub_ls = branches[i]
+        if len(sub_ls) == 0:
+            return bottom
+        subs = [bottom if j is None else (sem[j][0], [VMat(r.qvar, t * r.mat) for r in sem[j][1]])
+                for j, t in sub_ls]
+        if comb is None:
+            return subs[0]
+        return qtscalc_module.rho_combine(comb, subs)
+
+    iterations = 0
+    converged = True
+    for scc in scc_order([[j for j, _ in sub_ls if j is not None] for _, sub_ls in branches]):
+        if len(scc) == 1 and all(j != scc[0] for j, _ in branches[scc[0]][1]):
+            sem[scc[0]] = step(scc[0])
+            continue
+
+        for i in scc:
+            sem[i] = bottom
+        for _ in range(max_iterations):
+            # the states are updated in place (Gauss-Seidel), and the results are merged within 
+            # the tolerance, so that the sets accumulating to the limit stay finite
+            iterations += 1
+            done = True
+            for i in scc:
+                single, rho_ls = step(i)
+                rho_ls = qtscalc_module.rho_merge(rho_ls, eps)[0]
+                if done and not rho_close(rho_ls, sem[i][1], eps):
+                    done = False
+                sem[i] = (single, rho_ls)
+            if done:
+                break
+        else:
+            converged = False
+
+    single, rho_ls = sem[0]
+    rho_ls = [VMat(r.qvar, trace * r.mat) for r in rho_ls]
+    qts = QtsRho(rho_ls[0]) if single else QtsNondet([QtsRho(r) for r in rho_ls])
+    return FixpointRes(qts, len(states), iterations, converged)
@@ -0,0 +1,335 @@
+'''
+    The compact form of flowcharts: frozen numpy arrays instead of vertex and edge objects.
+
+    The successors are kept in the CSR layout: the out-edges of vertex [i] are the edges
+    offsets[i] .. offsets[i+1], in the order of the out-edges of the flowchart. Every edge has 
+    a kind and the index of its operator in the operator table, where equal operators are 
+    stored once. Strings (the register, the operators and the labels) are stored as utf-8 
+    buffers with offsets, so that all the arrays can be saved as .npy files and loaded 
+    without copying through np.load(mmap_mode='r').
+'''
+
+from __future__ import annotations
+from typing import List, Dict, Sequence, Tuple, Any, TYPE_CHECKING
+
+import os
+
+import numpy as np
+
+from ..qast import AstQVar, AstVOpt
+from ..backend import *
+from .vertex_edge import *
+from .plan import *
+
+if TYPE_CHECKING:
+    from .flowchart import Flowchart
+
+# increased whenever the stored format changes
+COMPACT_FORMAT = 1
+
+# vertex kinds
+V_TERM = 0
+V_ORDINARY = 1
+V_PARALLEL = 2
+V_MEASURE = 3
+
+# edge kinds
+E_ID = 0
+E_UNITARY = 1
+E_ABORT = 2
+E_INIT = 3
+E_MEASURE = 4
+
+vertex_kinds = {TVertex : V_TERM, OVertex : V_ORDINARY, PVertex : V_PARALLEL, MVertex : V_MEASURE}
+edge_kinds = {IdEdge : E_ID, UEdge : E_UNITARY, AEdge : E_ABORT, InitEdge : E_INIT, MEdge : E_MEASURE}
+
+
+def pack_strs(strs : Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+        the utf-8 buffer of the strings concatenated, and the offsets of the strings in it
+    '''
+    data = [s.encode() for s in strs]
+    offsets = np.zeros(len(data) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in data])
+    return np.frombuffer(b''.join(data), dtype = np.uint8), offsets
+
+def unpack_str(buf : np.ndarray, offsets : np.ndarray, i : int) -> str:
+    return buf[offsets[i] : offsets[i+1]].tobytes().decode()
+
+
+class CompactFlowchart:
+    '''
+    The frozen compact form of a flowchart, built by [from_flowchart] or [load]:
+        vkind : the kinds of the vertices (uint8),
+        offsets, succ : the successors in the CSR layout (int64),
+        ekind : the kinds of the edges (uint8),
+        eopt : the operator indices of the edges, -1 for edges without operators (int32),
+    and the operator table, where an initialization is stored with the empty operator name.
+    The labels are optional and decoded on request. It can be simulated by [vecsim] directly, 
+    and converted back by [to_flowchart] for [qtscalc].
+    '''
+
+    # the names of the arrays, which are also the file names
+    arrays = ('vkind', 'offsets', 'succ', 'ekind', 'eopt', 
+              'opt_name', 'opt_name_offsets', 'opt_qvar', 'opt_qvar_offsets',
+              'reg', 'reg_offsets', 'label_buf', 'label_offsets')
+
+    def __init__(self, data : Dict[str, np.ndarray], optlib : OptEnv | None = None):
+        for name in self.arrays:
+            setattr(self, name, data[name])
+        self._optlib = optlib
+        self._opts : List[AstVOpt | AstQVar] | None = None
+        self._register : QVar | None = None
+        self._plans : Dict[Tuple[str, ...], ExecPlan] = {}
+
+    @staticmethod
+    def from_flowchart(fc : Flowchart, labels = True) -> CompactFlowchart:
+        '''
+            the compact form of [fc] (expanded completely if lazy). 
+            labels : whether to keep the labels of the vertices
+        '''
+        for v in fc.vertices:
+            fc.expand(v)
+
+        opt_index : Dict[AstVOpt | AstQVar, int] = {}
+        vkind = np.zeros(len(fc.vertices), dtype = np.uint8)
+        offsets = np.zeros(len(fc.vertices) + 1, dtype = np.int64)
+        succ : List[int] = []
+        ekind : List[int] = []
+        eopt : List[int] = []
+        for v in fc.vertices:
+            vkind[v.id] = vertex_kinds[type(v)]
+            offsets[v.id + 1] = offsets[v.id] + len(v.outE)
+            for e in v.outE:
+                succ.append(e.B.id)
+                ekind.append(edge_kinds[type(e)])
+                opt = edge_operator(e)
+                eopt.append(-1 if opt is None else opt_index.setdefault(opt, len(opt_index)))
+
+        data : Dict[str, np.ndarray] = {
+            'vkind' : vkind, 'offsets' : offsets,
+            'succ' : np.array(succ, dtype = np.int64),
+            'ekind' : np.array(ekind, dtype = np.uint8),
+            'eopt' : np.array(eopt, dtype = np.int32)}
+        
+        opts = list(opt_index)
+        data['opt_name'], data['opt_name_offsets'] = pack_strs(
+            [opt.opt_id if isinstance(opt, AstVOpt) else '' for opt in opts])
+        data['opt_qvar'], data['opt_qvar_offsets'] = pack_strs(
+            [' '.join(opt.qvar.ls if isinstance(opt, AstVOpt) else opt.ls) for opt in opts])
+        data['reg'], data['reg_offsets'] = pack_strs(fc.register.ls)
+        data['label_buf'], data['label_offsets'] = pack_strs(
+            [str(v.label) for v in fc.vertices] if labels else [])
+        
+        cfc = CompactFlowchart(data, fc._optlib)
+        cfc._opts = opts
+        return cfc
+
+    def __len__(self) -> int:
+        return len(self.vkind)
+    
+    @property
+    def optlib(self) -> OptEnv:
+        if self._optlib is None:
+            raise ValueError("Operator libarary not designated.")
+        
+        return self._optlib
+    
+    @property
+    def register(self) -> QVar:
+        if self._register is None:
+            self._register = QVar([unpack_str(self.reg, self.reg_offsets, i) 
+                                   for i in range(len(self.reg_offsets) - 1)])
+        return self._register
+    
+    @property
+    def opts(self) -> List[AstVOpt | AstQVar]:
+        '''
+            the operator table, decoded on the first use
+        '''
+        if self._opts is None:
+            self._opts = []
+            for i in range(len(self.opt_name_offsets) - 1):
+                name = unpack_str(self.opt_name, self.opt_name_offsets, i)
+                qvar = AstQVar(unpack_str(self.opt_qvar, self.opt_qvar_offsets, i).split())
+                self._opts.append(AstVOpt(name, qvar) if name else qvar)
+        return self._opts
+    
+    @property
+    def has_labels(self) -> bool:
+        return len(self.label_offsets) == len(self.vkind) + 1
+
+    def label(self, vid : int) -> str | None:
+        '''
+            the label of vertex [vid], or None if the labels are dropped
+        '''
+        if not self.has_labels:
+            return None
+        return unpack_str(self.label_buf, self.label_offsets, vid)
+    
+    def drop_labels(self) -> CompactFlowchart:
+        '''
+            the compact flowchart without the labels, sharing all the other arrays
+        '''
+        data = {name : getattr(self, name) for name in self.arrays}
+        data['label_buf'], data['label_offsets'] = pack_strs([])
+        cfc = CompactFlowchart(data, self._optlib)
+        cfc._opts = self._opts
+        return cfc
+    
+    def nbytes(self) -> int:
+        '''
+            the total size of the arrays
+        '''
+        return sum(getattr(self, name).nbytes for name in self.arrays)
+
+    def plan(self, reg : QVar) -> ExecPlan:
+        '''
+            The execution plan of this flowchart on [reg], which should contain the register.
+            It is lowered once for every register.
+        '''
+        key = tuple(reg.ls)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = CompactPlan(self, reg)
+            self._plans[key] = plan
+        return plan
+    
+    def __getstate__(self) -> Dict:
+        state = {name : np.asarray(getattr(self, name)) for name in self.arrays}
+        state['_optlib'] = self._optlib
+        return state
+    
+    def __setstate__(self, state : Dict) -> None:
+        self.__init__(state, state['_optlib'])
+
+    def save(self, path : str) -> None:
+        '''
+            save the arrays as .npy files in the directory [path]. The operator library is not saved.
+        '''
+        os.makedirs(path, exist_ok = True)
+        np.save(os.path.join(path, 'format.npy'), np.array(COMPACT_FORMAT))
+        for name in self.arrays:
+            np.save(os.path.join(path, name + '.npy'), np.asarray(getattr(self, name)))
+
+    @staticmethod
+    def load(path : str, optlib : OptEnv | None = None, mmap = True) -> CompactFlowchart:
+        '''
+            load the compact flowchart saved by [save], with the operator library [optlib] 
+            (the default one if not designated). 
+            mmap : whether to map the files into memory instead of reading them
+        '''
+        if optlib is None:
+            optlib = get_optlib()
+
+        if int(np.load(os.path.join(path, 'format.npy'))) != COMPACT_FORMAT:
+            raise ValueError("Incompatible compact flowchart format: " + path)
+        
+        mode = 'r' if mmap else None
+        data = {name : np.load(os.path.join(path, name + '.npy'), mmap_mode = mode, allow_pickle = False)
+                for name in CompactFlowchart.arrays}
+        return CompactFlowchart(data, optlib)
+
+    def to_flowchart(self) -> Flowchart:
+        '''
+            the flowchart of vertex and edge objects, for example for [qtscalc]. 
+            The labels are the label strings (None if dropped).
+        '''
+        from .flowchart import Flowchart
+        fc = Flowchart()
+        vertex_cls = {kind : cls for cls, kind in vertex_kinds.items()}
+        for i, kind in enumerate(self.vkind.tolist()):
+            v = vertex_cls[kind](self.label(i), i)
+            fc.vertices.append(v)
+            if v.label is not None:
+                fc._index[v.label] = v
+
+        opts = self.opts
+        for i, v in enumerate(fc.vertices):
+            for j in range(self.offsets[i], self.offsets[i+1]):
+                vB = fc.vertices[self.succ[j]]
+                kind = self.ekind[j]
+                if kind == E_ID:
+                    e = IdEdge(v, vB)
+                elif kind == E_UNITARY:
+                    e = UEdge(v, vB, opts[self.eopt[j]])
+                elif kind == E_ABORT:
+                    e = AEdge(v, vB)
+                elif kind == E_INIT:
+                    e = InitEdge(v, vB, opts[self.eopt[j]])
+                elif kind == E_MEASURE:
+                    e = MEdge(v, vB, opts[self.eopt[j]])
+                else:
+                    raise Exception()
+                fc.edges.append(e)
+                v.outE.append(e)
+                vB.inE.append(e)
+
+        fc._optlib = self._optlib
+        fc._register = self.register
+        return fc
+    
+
+class CompactPlan(ExecPlan):
+    '''
+    The execution plan of a compact flowchart, lowered from the arrays. 
+    Every operator in the table is evaluated once.
+    '''
+    def __init__(self, fc : CompactFlowchart, reg : QVar):
+        self.fc = fc
+        self.reg = reg
+        self.shape = (2,) * len(reg)
+
+        optlib = fc.optlib
+        opts = fc.opts
+
+        # the placed operators of the table, evaluated on the first use
+        placed : Dict[Tuple[int, int], Any] = {}
+        def place(j : int, kind : int) -> Any:
+            key = (int(fc.eopt[j]), kind)
+            if key not in placed:
+                opt = opts[key[0]]
+                if kind == E_UNITARY:
+                    placed[key] = self._place(uopt_eval(opt, optlib))
+                elif kind == E_MEASURE:
+                    placed[key] = self._place(mopt_eval(opt, optlib))
+                else:
+                    placed[key] = [(self.reg.perm_idx_to(QVar([q]))[0], INIT_KRAUS) for q in opt.ls]
+            return placed[key]
+
+        vkind = fc.vkind.tolist()
+        offsets = fc.offsets.tolist()
+        succ = fc.succ.tolist()
+        ekind = fc.ekind.tolist()
+
+        self.succ = [succ[offsets[i] : offsets[i+1]] for i in range(len(vkind))]
+        self.op = []
+        self.opt = []
+        for i, kind in enumerate(vkind):
+            lo, hi = offsets[i], offsets[i+1]
+            if kind == V_TERM:
+                op, opt = OP_TERM, None
+            elif hi - lo == 1 and ekind[lo] == E_ID:
+                op, opt = OP_ID, None
+            elif hi - lo == 1 and ekind[lo] == E_UNITARY:
+                op, opt = OP_UNITARY, place(lo, E_UNITARY)
+            elif hi - lo == 1 and ekind[lo] == E_ABORT:
+                op, opt = OP_ABORT, None
+            elif hi - lo == 1 and ekind[lo] == E_INIT:
+                op, opt = OP_INIT, place(lo, E_INIT)
+            elif kind == V_PARALLEL:
+                op, opt = OP_PARALLEL, None
+            elif kind == V_MEASURE:
+                if any(ekind[j] != E_MEASURE for j in range(lo, hi)):
+                    raise Exception()
+                op, opt = OP_MEASURE, [place(j, E_MEASURE) for j in range(lo, hi)]
+            else:
+                raise Exception()
+            self.op.append(op)
+            self.opt.append(opt)
+
+    def expand(self, vid : int) -> None:
+        '''
+            all the vertices of a compact flowchart are expanded
+        '''
+        pass
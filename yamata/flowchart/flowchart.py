@@ -1,13 +1,18 @@
 
 from __future__ import annotations
-from typing import List
+from typing import List, Dict, Tuple, Callable, TYPE_CHECKING
+from collections import Counter
 
 from ..qast import *
 from ..backend import *
 
 from .vertex_edge import *
+from .plan import ExecPlan
 
-from graphviz import Digraph
+# graphviz is only imported for drawing
+if TYPE_CHECKING:
+    from graphviz import Digraph
+    from .compact import CompactFlowchart
 
 class Flowchart:
     def __init__(self):
@@ -15,7 +20,12 @@ class Flowchart:
         # all vertices for this flowchart
         self.vertices : List[Vertex] = []
         self.edges : List[Edge] = []
+
+        # the map from (hashed) labels to vertices
+        self._index : Dict[AstStatement, Vertex] = {}
         self._optlib : OptEnv | None = None
+        self._register : QVar | None = None
+        self._plans : Dict[Tuple[str, ...], ExecPlan] = {}
 
     @property
     def optlib(self) -> OptEnv:
@@ -23,16 +33,195 @@ class Flowchart:
             raise ValueError("Operator libarary not designated.")
         
         return self._optlib
+    
+    @property
+    def register(self) -> QVar:
+        '''
+            The program-wide qubit register, in the order of first appearance on the edges.
+            States are allocated on (an extension of) this register once, so that all the
+            operators are placed on the same axis order during the calculation.
+        '''
+        if self._register is None:
+            ls : List[str] = []
+            for e in self.edges:
+                if isinstance(e, UEdge) or isinstance(e, MEdge):
+                    qvar = e.vopt.qvar
+                elif isinstance(e, InitEdge):
+                    qvar = e.qvar
+                else:
+                    continue
+                for q in qvar.ls:
+                    if q not in ls:
+                        ls.append(q)
+            self._register = QVar(ls)
+
+        return self._register
+    
+    def plan(self, reg : QVar) -> ExecPlan:
+        '''
+            The execution plan of this flowchart on [reg], which should contain the register.
+            It is lowered once for every register.
+        '''
+        key = tuple(reg.ls)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = ExecPlan(self, reg)
+            self._plans[key] = plan
+        return plan
+    
+    def __getstate__(self) -> Dict:
+        '''
+            The flat state for pickling. Vertices and edges are stored in lists and refer to
+            each other by vertex ids, so that pickling does not recurse along the graph.
+            The labels are flattened into a table of syntax tree nodes (see ast_flatten) for
+            the same reason.
+        '''
+        labels, label_ids = ast_flatten([v.label for v in self.vertices])
+        vertices = [(type(v), i) for v, i in zip(self.vertices, label_ids)]
+        edges = []
+        for e in self.edges:
+            attrs = {key : value for key, value in e.__dict__.items() if key not in ('A', 'B')}
+            edges.append((type(e), e.A.id, e.B.id, attrs))
+
+        return {'labels' : labels, 'vertices' : vertices, 'edges' : edges, 
+                '_optlib' : self._optlib, '_register' : self._register}
+    
+    def __setstate__(self, state : Dict) -> None:
+        labels = ast_unflatten(state['labels'])
+        self.vertices = [cls(labels[label], i) for i, (cls, label) in enumerate(state['vertices'])]
+        self.edges = []
+        for cls, a, b, attrs in state['edges']:
+            e = cls.__new__(cls)
+            e.__dict__.update(attrs)
+            e.A = self.vertices[a]
+            e.B = self.vertices[b]
+            self.edges.append(e)
+            e.A.outE.append(e)
+            e.B.inE.append(e)
+        self._index = {v.label : v for v in self.vertices}
+
+        self._optlib = state['_optlib']
+        self._register = state['_register']
+        self._plans = {}
+
+    def expanded(self, v : Vertex) -> bool:
+        '''
+            Whether the out-edges of [v] are constructed. Always true except for lazy flowcharts.
+        '''
+        return True
+    
+    def expand(self, v : Vertex) -> None:
+        '''
+            Construct the out-edges of [v] if not done yet. Nothing to do except for lazy flowcharts.
+        '''
+        pass
+
+    def minimize(self, weak : bool = False) -> Flowchart:
+        '''
+            The quotient of this flowchart by the coarsest bisimulation, as a new flowchart.
+            Two vertices are bisimilar if they are of the same kind and their outgoing edges, 
+            counted with multiplicity, agree on the edge kinds, the operators and the blocks 
+            of the targets. Every edge is a step, so the step counts are kept and [vecsim] and 
+            [qtscalc] give the same results on the quotient.
+            weak : also skip the silent vertices, whose outgoing edges are all identity edges
+                into the same block (e.g. the chains of scheduling choices that lead to the 
+                same behaviour). The results are kept but the step counts become smaller.
+            The blocks are numbered by their first vertices, and the first vertex of a block 
+            is its representative, so that the initial vertex (or the vertex it silently 
+            leads to) is vertex 0.
+        '''
+        # lazy flowcharts are expanded completely (the list grows on the way)
+        for v in self.vertices:
+            self.expand(v)
+
+        # alias[i] : the vertex that the silent vertex [i] is skipped to
+        alias : Dict[int, int] = {}
+        def find(i : int) -> int:
+            while i in alias:
+                i = alias[i]
+            return i
+
+        while True:
+            block = self._refine(find)
+            if not weak:
+                break
+
+            skipped = False
+            for v in self.vertices:
+                if v.id in alias or isinstance(v, TVertex) or len(v.outE) == 0:
+                    continue
+                if not all(isinstance(e, IdEdge) for e in v.outE):
+                    continue
+                targets = [find(e.B.id) for e in v.outE]
+                if v.id in targets or len({block[t] for t in targets}) > 1:
+                    continue
+                alias[v.id] = targets[0]
+                skipped = True
+
+            if not skipped:
+                break
+
+        # number the blocks by their first vertices, from the initial one
+        order = [find(0)] + [v.id for v in self.vertices if v.id not in alias]
+        reps : Dict[int, Vertex] = {}
+        for i in order:
+            if block[i] not in reps:
+                reps[block[i]] = self.vertices[i]
+        number = {b : n for n, b in enumerate(reps)}
+
+        fc = Flowchart()
+        for b, v in reps.items():
+            fc.vertices.append(type(v)(v.label, number[b]))
+        for v in self.vertices:
+            fc._index[v.label] = fc.vertices[number[block[find(v.id)]]]
+
+        for b, v in reps.items():
+            for e in v.outE:
+                qe = type(e).__new__(type(e))
+                qe.__dict__.update(e.__dict__)
+                qe.A = fc.vertices[number[b]]
+                qe.B = fc.vertices[number[block[find(e.B.id)]]]
+                fc.edges.append(qe)
+                qe.A.outE.append(qe)
+                qe.B.inE.append(qe)
+
+        fc._optlib = self._optlib
+        fc._register = self.register
+        return fc
+
+    def _refine(self, find : Callable[[int], int]) -> List[int]:
+        '''
+            the blocks of the coarsest bisimulation by partition refinement, starting from 
+            the vertex kinds, with the targets of the edges resolved by [find]
+        '''
+        block = [0] * len(self.vertices)
+        count = 0
+        while True:
+            sigs : Dict[Tuple, int] = {}
+            new_block = []
+            for v in self.vertices:
+                out = Counter((type(e), edge_operator(e), block[find(e.B.id)]) for e in v.outE)
+                sig = (block[v.id], type(v), frozenset(out.items()))
+                new_block.append(sigs.setdefault(sig, len(sigs)))
+            block = new_block
+            if len(sigs) == count:
+                return block
+            count = len(sigs)
+
+    def compact(self, labels = True) -> CompactFlowchart:
+        '''
+            the frozen compact form of this flowchart (see CompactFlowchart)
+            labels : whether to keep the labels of the vertices
+        '''
+        from .compact import CompactFlowchart
+        return CompactFlowchart.from_flowchart(self, labels)
 
     def findV(self, label) -> None | Vertex:
         '''
             Find the vertex of the given label in the flowchart.
             If not found, return None.
         '''
-        for v in self.vertices:
-            if v.label == label:
-                return v
-        return None
+        return self._index.get(label)
     
     def createV(self, label : AstStatement) -> Vertex:
         '''
@@ -49,6 +238,7 @@ class Flowchart:
             v = OVertex(label, len(self.vertices))
 
         self.vertices.append(v)
+        self._index[label] = v
         return v
     
     
@@ -80,6 +270,7 @@ class Flowchart:
         '''
             output the flowchart diagram
         '''
+        from graphviz import Digraph
         dot = Digraph()
 
         
@@ -102,7 +293,7 @@ class Flowchart:
         '''
             display the neighbour vertices of a given vertex
         '''
-
+        from graphviz import Digraph
         dot = Digraph()
         v = self.vertices[v_id]
 
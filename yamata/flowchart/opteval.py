@@ -6,7 +6,7 @@ from ..qast import AstQVar, AstVOpt
 from ..backend import *
 
 def qvar_backend(qvar : AstQVar) -> QVar:
-    return QVar(qvar.ls)
+    return QVar(list(qvar.ls))
 
 def uopt_eval(vopt : AstVOpt, optlib : OptEnv) -> VMat:
     return VMat(qvar_backend(vopt.qvar), optlib.unitary_opt[vopt.opt_id])
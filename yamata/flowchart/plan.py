@@ -0,0 +1,113 @@
+'''
+    The execution plan: a flowchart lowered to integer opcodes and successor lists, 
+    with all the operators resolved and laid out for a qubit register.
+'''
+
+from __future__ import annotations
+from typing import List, Tuple, Any, TYPE_CHECKING
+
+import numpy as np
+
+from ..backend import *
+from .vertex_edge import *
+
+if TYPE_CHECKING:
+    from .flowchart import Flowchart
+
+
+# opcodes
+OP_TERM = 0         # terminal vertex
+OP_ID = 1           # identity edge
+OP_UNITARY = 2      # unitary edge, opt : (axes, matrix)
+OP_ABORT = 3        # abort edge
+OP_INIT = 4         # initialization edge, opt : [(axis, [K0, K1]) for every qubit]
+OP_PARALLEL = 5     # parallel composition vertex
+OP_MEASURE = 6      # measurement vertex, opt : [(axes, matrix) for every branch]
+OP_UNEXPANDED = 7   # vertex of a lazy flowchart not expanded yet, see ExecPlan.expand
+
+# Kraus operators of the initialization of one qubit: |0><0| and |0><1|
+INIT_KRAUS = [np.array([[1., 0.], [0., 0.]]), np.array([[0., 1.], [0., 0.]])]
+
+
+class ExecPlan:
+    '''
+    The execution plan of a flowchart on the register [reg]. Vertex ids are kept, and for
+    every vertex [i] there are:
+        op[i] : the opcode,
+        succ[i] : the list of successor vertex ids, in the order of the outgoing edges,
+        opt[i] : the operators (see the opcodes), with the axes of their qubits in [reg].
+    For lazy flowcharts, the plan grows as the vertices are expanded.
+    '''
+    def __init__(self, fc : Flowchart, reg : QVar):
+        self.fc = fc
+        self.reg = reg
+        self.shape = (2,) * len(reg)
+
+        self.op : List[int] = []
+        self.succ : List[List[int]] = []
+        self.opt : List[Any] = []
+
+        for v in fc.vertices:
+            self.lower(v, fc.optlib)
+
+    def lower(self, v : Vertex, optlib : OptEnv) -> None:
+        '''
+            append the lowered vertex [v] to the plan
+        '''
+        op, opt = self._lower(v, optlib)
+        self.op.append(op)
+        self.succ.append([e.B.id for e in v.outE])
+        self.opt.append(opt)
+
+    def expand(self, vid : int) -> None:
+        '''
+            Expand the vertex [vid] of the lazy flowchart (if not done through another plan 
+            yet), and lower it again together with the new vertices.
+        '''
+        v = self.fc.vertices[vid]
+        self.fc.expand(v)
+        for u in self.fc.vertices[len(self.op):]:
+            self.lower(u, self.fc.optlib)
+
+        self.op[vid], self.opt[vid] = self._lower(v, self.fc.optlib)
+        self.succ[vid] = [e.B.id for e in v.outE]
+
+    def _lower(self, v : Vertex, optlib : OptEnv) -> Tuple[int, Any]:
+        if not self.fc.expanded(v):
+            return OP_UNEXPANDED, None
+
+        if isinstance(v, TVertex):
+            return OP_TERM, None
+
+        if len(v.outE) == 1:
+            e = v.outE[0]
+            if isinstance(e, IdEdge):
+                return OP_ID, None
+
+            if isinstance(e, UEdge):
+                return OP_UNITARY, self._place(uopt_eval(e.vopt, optlib))
+
+            if isinstance(e, AEdge):
+                return OP_ABORT, None
+
+            if isinstance(e, InitEdge):
+                return OP_INIT, [(self.reg.perm_idx_to(QVar([q]))[0], INIT_KRAUS) for q in e.qvar.ls]
+
+        if isinstance(v, PVertex):
+            return OP_PARALLEL, None
+
+        if isinstance(v, MVertex):
+            opt_ls = []
+            for e in v.outE:
+                if not isinstance(e, MEdge):
+                    raise Exception()
+                opt_ls.append(self._place(mopt_eval(e.vopt, optlib)))
+            return OP_MEASURE, opt_ls
+
+        raise Exception()
+
+    def _place(self, vmat : VMat) -> Tuple[Tuple[int, ...], np.ndarray]:
+        '''
+            the axes of the operator in the register, and its matrix
+        '''
+        return self.reg.perm_idx_to(vmat.qvar), vmat.mat
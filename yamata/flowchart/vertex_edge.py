@@ -1,8 +1,9 @@
 
 from __future__ import annotations
-from typing import List, Dict
+from typing import List, Dict, TYPE_CHECKING
 
-from graphviz import Digraph
+if TYPE_CHECKING:
+    from graphviz import Digraph
 
 from yamata.backend import OptEnv
 from yamata.flowchart.opteval import OptEnv
@@ -293,3 +294,13 @@ class MEdge(Edge):
             raise ValueError("Invalid measurement branch: " + str(self.vopt))
 
 
+def edge_operator(e : Edge) -> AstVOpt | AstQVar | None:
+    '''
+        the operator reference of the edge: the operator of unitary and measurement edges, 
+        the initialized qubits of initialization edges, and None otherwise
+    '''
+    if isinstance(e, UEdge) or isinstance(e, MEdge):
+        return e.vopt
+    if isinstance(e, InitEdge):
+        return e.qvar
+    return None
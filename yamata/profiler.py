@@ -0,0 +1,265 @@
+'''
+    Opt-in instrumentation of the hot paths in compilation, vecsim and qtscalc.
+
+    The instrumentation is installed by replacing the hot functions and methods with
+    recording wrappers when a profiler is enabled, and restoring them when it is disabled.
+    Nothing is changed otherwise, so there is no overhead without profiling.
+
+    Example:
+        with Profiler() as prof:
+            fc = compile(code)
+            vecsim(fc, vinit, 100, 1000)
+        print(prof.report)
+        fc.show("output/flowchart", asn_label = prof.report.asn_label())
+'''
+
+from __future__ import annotations
+from typing import List, Tuple, Dict, Any, Callable
+
+import sys
+import importlib
+from time import perf_counter
+
+import numpy as np
+
+from .backend import backend
+from .backend.backend import VTerm, VVec, VMat
+from .flowchart.flowchart import Flowchart
+from .flowchart.vertex_edge import *
+from .flowchart.plan import *
+
+# the modules (the package attribute [qtscalc] is the function of the same name)
+vecsim_module = importlib.import_module(".vecSim", __package__)
+qtscalc_module = importlib.import_module(".qtscalc", __package__)
+
+
+# the edge type for every opcode
+op_edge_type = {
+    OP_ID : "IdEdge",
+    OP_UNITARY : "UEdge",
+    OP_ABORT : "AEdge",
+    OP_INIT : "InitEdge",
+    OP_PARALLEL : "IdEdge",
+    OP_MEASURE : "MEdge",
+}
+
+# backend operations whose allocations are recorded
+backend_ops = {
+    VVec : ["Mapply", "extend_to", "transform_to", "__add__", "__sub__", "normalized", "outer"],
+    VMat : ["mul", "Oapply", "SOapply", "extend_to", "transform_to", "__add__", "__sub__", "dagger"],
+}
+
+
+def vertex_edge_type(v : Vertex) -> str | None:
+    '''
+        the type of the edges taken at vertex [v], as in the calculation
+    '''
+    if isinstance(v, TVertex):
+        return None
+    if len(v.outE) == 1 and not isinstance(v.outE[0], MEdge):
+        return type(v.outE[0]).__name__
+    if isinstance(v, PVertex):
+        return "IdEdge"
+    return "MEdge"
+
+
+class ProfileReport:
+    '''
+    The structured report of profiling.
+        vertex_visits : vertex id -> number of visits (of samplings in vecsim, of calls in qtscalc)
+        edge_time : edge type -> seconds spent on taking the edges of this type
+        edge_count : edge type -> number of times the edges of this type are taken
+        alloc_bytes : backend operation -> bytes of the results allocated by the operation
+            (operations called inside other operations are counted for both)
+        alloc_count : backend operation -> number of calls
+        findV_lookups : number of calls of Flowchart.findV
+        findV_misses : number of calls of Flowchart.findV that found no vertex
+    '''
+    def __init__(self):
+        self.vertex_visits : Dict[int, int] = {}
+        self.edge_time : Dict[str, float] = {}
+        self.edge_count : Dict[str, int] = {}
+        self.alloc_bytes : Dict[str, int] = {}
+        self.alloc_count : Dict[str, int] = {}
+        self.findV_lookups = 0
+        self.findV_misses = 0
+
+    def visit(self, vid : int, times : int = 1) -> None:
+        self.vertex_visits[vid] = self.vertex_visits.get(vid, 0) + times
+
+    def edge(self, edge_type : str, dt : float, times : int = 1) -> None:
+        self.edge_time[edge_type] = self.edge_time.get(edge_type, 0.) + dt
+        self.edge_count[edge_type] = self.edge_count.get(edge_type, 0) + times
+
+    def alloc(self, op : str, nbytes : int) -> None:
+        self.alloc_bytes[op] = self.alloc_bytes.get(op, 0) + nbytes
+        self.alloc_count[op] = self.alloc_count.get(op, 0) + 1
+
+    def hot_vertices(self, n : int = 10) -> List[Tuple[int, int]]:
+        '''
+            the [n] most visited vertices, as (vertex id, visits)
+        '''
+        return sorted(self.vertex_visits.items(), key = lambda item : -item[1])[:n]
+
+    def asn_label(self) -> Dict[int, str]:
+        '''
+            the visit counts as assertion labels, to be overlaid by Flowchart.show
+        '''
+        return {vid : "visits: " + str(n) for vid, n in self.vertex_visits.items()}
+
+    def __str__(self) -> str:
+        r = "findV lookups: " + str(self.findV_lookups) + " (" + str(self.findV_misses) + " misses)\n"
+
+        r += "edges:\n"
+        for t in sorted(self.edge_time, key = lambda t : -self.edge_time[t]):
+            r += "  %-10s %10d  %.6fs\n" % (t, self.edge_count[t], self.edge_time[t])
+
+        r += "backend allocations:\n"
+        for op in sorted(self.alloc_bytes, key = lambda op : -self.alloc_bytes[op]):
+            r += "  %-24s %10d  %d bytes\n" % (op, self.alloc_count[op], self.alloc_bytes[op])
+
+        r += "hot vertices:\n"
+        for vid, n in self.hot_vertices():
+            r += "  #%-8d %d\n" % (vid, n)
+        return r
+
+
+def nbytes(obj : Any) -> int:
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, VVec):
+        return obj.vec.nbytes
+    if isinstance(obj, VMat):
+        return obj.mat.nbytes
+    return 0
+
+
+class Profiler:
+    '''
+    The profiler. Instrumentation is installed between [enable] and [disable], 
+    or inside the [with] block. Only one profiler can be enabled at a time.
+    Samplings in worker processes (vecsim with workers > 1) are not recorded.
+    '''
+
+    _current : Profiler | None = None
+
+    def __init__(self):
+        self.report = ProfileReport()
+
+        # the replaced attributes: (owner, name, original)
+        self._patched : List[Tuple[Any, str, Any]] = []
+
+    def __enter__(self) -> Profiler:
+        self.enable()
+        return self
+    
+    def __exit__(self, *args) -> None:
+        self.disable()
+
+    @staticmethod
+    def current() -> Profiler | None:
+        return Profiler._current
+
+    def _patch(self, owner : Any, name : str, wrapper : Callable) -> None:
+        original = getattr(owner, name)
+        self._patched.append((owner, name, original))
+        setattr(owner, name, wrapper(original))
+
+    def enable(self) -> None:
+        if Profiler._current is not None:
+            raise Exception("Another profiler is enabled.")
+        Profiler._current = self
+        report = self.report
+
+        # compilation
+        def findV_wrapper(f):
+            def findV(fc : Flowchart, label):
+                v = f(fc, label)
+                report.findV_lookups += 1
+                if v is None:
+                    report.findV_misses += 1
+                return v
+            return findV
+        self._patch(Flowchart, "findV", findV_wrapper)
+
+        # backend
+        def alloc_wrapper(name : str):
+            def wrapper(f):
+                def op(*args, **kwargs):
+                    r = f(*args, **kwargs)
+                    # nothing is allocated if an argument is returned
+                    report.alloc(name, 0 if any(r is arg for arg in args) else nbytes(r))
+                    return r
+                return op
+            return wrapper
+        
+        for cls in backend_ops:
+            for method in backend_ops[cls]:
+                self._patch(cls, method, alloc_wrapper(cls.__name__ + "." + method))
+
+        # [tensor_apply] is imported by name in several modules
+        tensor_apply = backend.tensor_apply
+        for mod in list(sys.modules.values()):
+            if mod is not None and mod.__name__.startswith(__package__) \
+                and getattr(mod, "tensor_apply", None) is tensor_apply:
+                self._patch(mod, "tensor_apply", alloc_wrapper("tensor_apply"))
+
+        # vecsim
+        def step_wrapper(count_arg : Callable[[Tuple], int]):
+            def wrapper(f):
+                def step(plan : ExecPlan, vid : int, *args):
+                    times = count_arg(args)
+                    report.visit(vid, times)
+                    t = perf_counter()
+                    r = f(plan, vid, *args)
+                    if plan.op[vid] != OP_TERM:
+                        report.edge(op_edge_type[plan.op[vid]], perf_counter() - t, times)
+                    return r
+                return step
+            return wrapper
+        
+        self._patch(vecsim_module, "plan_next", step_wrapper(lambda args : 1))
+        self._patch(vecsim_module, "batch_next", step_wrapper(lambda args : len(args[0])))
+        self._patch(vecsim_module, "branch_next", step_wrapper(lambda args : int(args[1])))
+
+        # qtscalc : the time of recursive calls is excluded from the time of the caller
+        child_time : List[float] = []
+        def iter_wrapper(f):
+            def qtscalc_iter(v : Vertex, *args):
+                report.visit(v.id)
+                t = perf_counter()
+                child_time.append(0.)
+                try:
+                    return f(v, *args)
+                finally:
+                    dt = perf_counter() - t
+                    inner = child_time.pop()
+                    if len(child_time) > 0:
+                        child_time[-1] += dt
+                    edge_type = vertex_edge_type(v)
+                    if edge_type is not None:
+                        report.edge(edge_type, dt - inner)
+            return qtscalc_iter
+        self._patch(qtscalc_module, "qtscalc_iter", iter_wrapper)
+
+        # the other qtscalc engines and the fixpoint engine take every step through [rho_branches]
+        def branches_wrapper(f):
+            def rho_branches(v : Vertex, *args):
+                report.visit(v.id)
+                t = perf_counter()
+                r = f(v, *args)
+                edge_type = vertex_edge_type(v)
+                if edge_type is not None:
+                    report.edge(edge_type, perf_counter() - t)
+                return r
+            return rho_branches
+        self._patch(qtscalc_module, "rho_branches", branches_wrapper)
+
+    def disable(self) -> None:
+        if Profiler._current is not self:
+            return
+        
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched = []
+        Profiler._current = None
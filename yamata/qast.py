@@ -12,10 +12,21 @@
 
 
 from __future__ import annotations
-from typing import List
+from typing import List, Dict, Tuple, Sequence, FrozenSet
+from functools import lru_cache
+from hashlib import blake2b
+import weakref
 
+@lru_cache(maxsize=None)
+def str_hash(s : str) -> int:
+    '''
+    A hash of the string that is stable across processes (unlike the builtin one, see 
+    PYTHONHASHSEED), so that the cached hashes of pickled syntax trees stay valid.
+    '''
+    return int.from_bytes(blake2b(s.encode(), digest_size=8).digest(), "little", signed=True)
 
-def ls_uniqueness_check(ls : List) -> bool:
+
+def ls_uniqueness_check(ls : Sequence) -> bool:
     '''
     Checks whether all elements in the list are different from each other.
     '''
@@ -25,15 +36,110 @@ def ls_uniqueness_check(ls : List) -> bool:
                 return False
     return True
 
-class AstQVar:
-    def __init__(self, _ls : List[str]):
-        if not ls_uniqueness_check(_ls):
-            raise Exception()
-        
-        self.ls : List[str] = _ls
+
+# the footprint item of abort, which is no qubit : abort stops the whole program, so it 
+# depends on every other component
+ABORT_FOOTPRINT = '#abort'
+
+
+class AstNode:
+    '''
+        The base of all syntax tree nodes.
+
+        Nodes are immutable: the fields are assigned once in the constructor, together with 
+        the structural hash [_hash], which is calculated from the (cached) hashes of the 
+        components. Programs built from other programs share the unchanged subtrees, and 
+        copying a node returns the node itself.
+    '''
+    __slots__ = ('_hash', '_footprint')
+
+    def _init(self, **fields) -> None:
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def components(self) -> List[AstNode]:
+        '''
+            the direct components of this node
+        '''
+        r = []
+        for arg in self.__reduce__()[1]:
+            if isinstance(arg, AstNode):
+                r.append(arg)
+            elif isinstance(arg, tuple):
+                r += [item for item in arg if isinstance(item, AstNode)]
+        return r
+    
+    def footprint(self) -> FrozenSet[str]:
+        '''
+            the qubits that this node may act on (measured ones included), and ABORT_FOOTPRINT
+            if it may abort, calculated without recursion and cached in [_footprint]
+        '''
+        stack : List[AstNode] = [self]
+        while len(stack) > 0:
+            node = stack[-1]
+            if hasattr(node, '_footprint'):
+                stack.pop()
+                continue
+
+            components = node.components()
+            pending = [c for c in components if not hasattr(c, '_footprint')]
+            if len(pending) > 0:
+                stack += pending
+                continue
+            
+            stack.pop()
+            qubits = set(node.ls) if isinstance(node, AstQVar) else set()
+            if isinstance(node, AstAbort):
+                qubits.add(ABORT_FOOTPRINT)
+            for c in components:
+                qubits |= c._footprint
+            object.__setattr__(node, '_footprint', frozenset(qubits))
+
+        return self._footprint
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The syntax tree node " + type(self).__name__ + " is immutable.")
+    
+    def __delattr__(self, name):
+        raise AttributeError("The syntax tree node " + type(self).__name__ + " is immutable.")
+
+    def __copy__(self):
+        return self
+    
+    def __deepcopy__(self, memo):
+        return self
+    
+    def __hash__(self):
+        return self._hash
+
+
+class AstQVar(AstNode):
+    '''
+        Quantum variables are interned: equal variables are the same object.
+        The table holds them weakly, so that the unused ones are released.
+    '''
+    __slots__ = ('ls', '__weakref__')
+    _table : weakref.WeakValueDictionary[Tuple[str, ...], AstQVar] = weakref.WeakValueDictionary()
+
+    ls : Tuple[str, ...]
+
+    def __new__(cls, _ls : Sequence[str]):
+        key = tuple(_ls)
+        r = cls._table.get(key)
+        if r is None:
+            if not ls_uniqueness_check(key):
+                raise Exception()
+            
+            r = object.__new__(cls)
+            r._init(ls = key, _hash = hash(tuple(str_hash(id) for id in key)))
+            cls._table[key] = r
+        return r
+    
+    def __reduce__(self):
+        return (AstQVar, (self.ls,))
 
     def appended(self, id : str) -> AstQVar:
-        return AstQVar(self.ls + [id])
+        return AstQVar(self.ls + (id,))
     
     def __str__(self):
         if len(self.ls) == 0:
@@ -46,28 +152,63 @@ class AstQVar:
         return r
     
     def __eq__(self, other):
-        if type(self) != type(other):
+        if self is other:
+            return True
+        if type(self) != type(other) or self._hash != other._hash:
             return False
         return self.ls == other.ls
+    
+    def __hash__(self):
+        return self._hash
 
-class AstVOpt:
-    def __init__(self, _opt_id : str, _qvar : AstQVar):
-        self.opt_id = _opt_id
-        self.qvar = _qvar
+class AstVOpt(AstNode):
+    '''
+        Operators on variables are interned: equal ones are the same object.
+        The table holds them weakly, so that the unused ones are released.
+    '''
+    __slots__ = ('opt_id', 'qvar', '__weakref__')
+    _table : weakref.WeakValueDictionary[Tuple[str, AstQVar], AstVOpt] = weakref.WeakValueDictionary()
+
+    opt_id : str
+    qvar : AstQVar
+
+    def __new__(cls, _opt_id : str, _qvar : AstQVar):
+        key = (_opt_id, _qvar)
+        r = cls._table.get(key)
+        if r is None:
+            r = object.__new__(cls)
+            r._init(opt_id = _opt_id, qvar = _qvar, _hash = hash((str_hash(_opt_id), _qvar)))
+            cls._table[key] = r
+        return r
+    
+    def __reduce__(self):
+        return (AstVOpt, (self.opt_id, self.qvar))
     
     def __str__(self):
         return self.opt_id + str(self.qvar)
     
     def __eq__(self, other):
-        if type(self) != type(other):
+        if self is other:
+            return True
+        if type(self) != type(other) or self._hash != other._hash:
             return False
 
         return self.opt_id == other.opt_id and self.qvar == other.qvar
+    
+    def __hash__(self):
+        return self._hash
+
+class AstGuardedProg(AstNode):
+    __slots__ = ('vopt', 'prog')
+
+    vopt : AstVOpt
+    prog : AstStatement
 
-class AstGuardedProg:
     def __init__(self, _vopt : AstVOpt, _prog : AstStatement):
-        self.vopt = _vopt
-        self.prog = _prog
+        self._init(vopt = _vopt, prog = _prog, _hash = hash((_vopt, _prog)))
+    
+    def __reduce__(self):
+        return (AstGuardedProg, (self.vopt, self.prog))
 
     def to_str_prefix(self, pre: str) -> str:
         r = pre + '# ' + str(self.vopt) + ' ' + '->' + '\n' \
@@ -75,14 +216,21 @@ class AstGuardedProg:
         return r
     
     def __eq__(self, other):
-        if type(self) != type(other):
+        if self is other:
+            return True
+        if type(self) != type(other) or self._hash != other._hash:
             return False
 
         return self.vopt == other.vopt and self.prog == other.prog
+    
+    def __hash__(self):
+        return self._hash
 
 
 # Abstract syntax tree for programs
-class AstStatement:
+class AstStatement(AstNode):
+    __slots__ = ()
+
     def to_str_prefix(self, pre : str) -> str:
         raise NotImplementedError()
     
@@ -100,21 +248,42 @@ class AstStatement:
         
     def __eq__(self, other):
         raise NotImplementedError()
-
+    
+    def __hash__(self):
+        return self._hash
 
 class AstTerminal(AstStatement):
-    def __init__(self):
-        pass
+    __slots__ = ()
+    _hash = str_hash("AstTerminal")
+    _instance : AstTerminal | None = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = object.__new__(cls)
+        return cls._instance
+    
+    def __reduce__(self):
+        return (AstTerminal, ())
 
     def __str__(self):
         return "↓"
     
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
         return isinstance(other, AstTerminal)
     
 class AstLoop(AstStatement):
+    __slots__ = ('body',)
+
+    body : AstStatement
+
     def __init__(self, _body : AstStatement):
-        self.body = _body
+        self._init(body = _body, _hash = hash((str_hash("AstLoop"), _body)))
+    
+    def __reduce__(self):
+        return (AstLoop, (self.body,))
 
     def to_str_prefix(self, pre : str) -> str:
         r = pre + "loop\n"
@@ -122,86 +291,184 @@ class AstLoop(AstStatement):
         r += "\n" + pre + "end"
         return r
     
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
-        if not isinstance(other, AstLoop):
+        if self is other:
+            return True
+        if not isinstance(other, AstLoop) or self._hash != other._hash:
             return False
         return self.body == other.body
 
 
 class AstSeq(AstStatement):
+    __slots__ = ('S0', 'S1')
+
+    S0 : AstStatement
+    S1 : AstStatement
+
     def __init__(self, _S0 : AstStatement, _S1 : AstStatement):
         '''
             This constructor will convert any combination to the 
             right associative canonical form.
+            Only the spine of [_S0] is rebuilt, and [_S1] is shared.
+        '''
+        if isinstance(_S0, AstSeq):
+            # [_S0] is canonical already, so its spine is S0.S1.S1 ...
+            spine : List[AstStatement] = []
+            while isinstance(_S0, AstSeq):
+                spine.append(_S0.S0)
+                _S0 = _S0.S1
+            for S in reversed(spine[1:] + [_S0]):
+                _S1 = AstSeq.cons(S, _S1)
+            _S0 = spine[0]
+
+        self._init(S0 = _S0, S1 = _S1, _hash = hash((str_hash("AstSeq"), _S0, _S1)))
+
+    @staticmethod
+    def cons(S0 : AstStatement, S1 : AstStatement) -> AstSeq:
         '''
-        temp_S0 = _S0
-        temp_S1 = _S1
-        while isinstance(temp_S0, AstSeq):
-            temp_S1 = AstSeq(temp_S0.S1, temp_S1)
-            temp_S0 = temp_S0.S0
-        self.S0 = temp_S0
-        self.S1 = temp_S1
+            Construct the sequence directly, where [S0] should not be a sequence.
+        '''
+        r = object.__new__(AstSeq)
+        r._init(S0 = S0, S1 = S1, _hash = hash((str_hash("AstSeq"), S0, S1)))
+        return r
+    
+    def __reduce__(self):
+        return (AstSeq, (self.S0, self.S1))
     
     def to_str_prefix(self, pre : str) -> str:
-        r = self.S0.to_str_prefix(pre) + ";\n" + self.S1.to_str_prefix(pre)
+        # iterate along the spine, which can be arbitrarily long
+        r = self.S0.to_str_prefix(pre)
+        S = self.S1
+        while isinstance(S, AstSeq):
+            r += ";\n" + S.S0.to_str_prefix(pre)
+            S = S.S1
+        r += ";\n" + S.to_str_prefix(pre)
         return r
     
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
-        if not isinstance(other, AstSeq):
-            return False
+        # iterate along the spine, which can be arbitrarily long
+        a, b = self, other
+        while isinstance(a, AstSeq):
+            if a is b:
+                return True
+            if not isinstance(b, AstSeq) or a._hash != b._hash or a.S0 != b.S0:
+                return False
+            a, b = a.S1, b.S1
 
-        return self.S0 == other.S0 and self.S1 == other.S1
+        return a == b
 
 
 class AstSkip(AstStatement):
+    __slots__ = ()
+    _hash = str_hash("AstSkip")
+    _instance : AstSkip | None = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = object.__new__(cls)
+        return cls._instance
+    
+    def __reduce__(self):
+        return (AstSkip, ())
+
     def to_str_prefix(self, pre: str) -> str:
         return pre + 'skip'
     
-    def __eq__(self, other):
-        if not isinstance(other, AstSkip):
-            return False
+    def __hash__(self):
+        return self._hash
 
+    def __eq__(self, other):
         return isinstance(other, AstSkip)
 
 class AstAbort(AstStatement):
+    __slots__ = ()
+    _hash = str_hash("AstAbort")
+    _instance : AstAbort | None = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = object.__new__(cls)
+        return cls._instance
+    
+    def __reduce__(self):
+        return (AstAbort, ())
+
     def to_str_prefix(self, pre: str) -> str:
         return pre + 'abort'
     
-    def __eq__(self, other):
-        if not isinstance(other, AstAbort):
-            return False
+    def __hash__(self):
+        return self._hash
 
+    def __eq__(self, other):
         return isinstance(other, AstAbort)
 
 class AstInit(AstStatement):
+    __slots__ = ('qvar',)
+
+    qvar : AstQVar
+
     def __init__(self, _qvar : AstQVar):
-        self.qvar = _qvar
+        self._init(qvar = _qvar, _hash = hash((str_hash("AstInit"), _qvar)))
+    
+    def __reduce__(self):
+        return (AstInit, (self.qvar,))
 
     def to_str_prefix(self, pre: str) -> str:
         return pre + str(self.qvar) + ' ' + ':=0'
     
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
-        if not isinstance(other, AstInit):
+        if self is other:
+            return True
+        if not isinstance(other, AstInit) or self._hash != other._hash:
             return False
 
         return self.qvar == other.qvar
 
 class AstUnitary(AstStatement):
+    __slots__ = ('vopt',)
+
+    vopt : AstVOpt
+
     def __init__(self, _vopt : AstVOpt):
-        self.vopt = _vopt
+        self._init(vopt = _vopt, _hash = hash((str_hash("AstUnitary"), _vopt)))
+    
+    def __reduce__(self):
+        return (AstUnitary, (self.vopt,))
 
     def to_str_prefix(self, pre: str) -> str:
         return pre + str(self.vopt)
     
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
-        if not isinstance(other, AstUnitary):
+        if self is other:
+            return True
+        if not isinstance(other, AstUnitary) or self._hash != other._hash:
             return False
 
         return self.vopt == other.vopt
 
 class AstIf(AstStatement):
-    def __init__(self, _ls : List[AstGuardedProg]):
-        self.ls = _ls
+    __slots__ = ('ls',)
+
+    ls : Tuple[AstGuardedProg, ...]
+
+    def __init__(self, _ls : Sequence[AstGuardedProg]):
+        ls = tuple(_ls)
+        self._init(ls = ls, _hash = hash((str_hash("AstIf"),) + ls))
+    
+    def __reduce__(self):
+        return (AstIf, (self.ls,))
 
     def to_str_prefix(self, pre: str) -> str:
         r = pre + "if \n"
@@ -210,16 +477,29 @@ class AstIf(AstStatement):
         r += pre + "end"
         return r
     
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
-        if not isinstance(other, AstIf):
+        if self is other:
+            return True
+        if not isinstance(other, AstIf) or self._hash != other._hash:
             return False
 
         return self.ls == other.ls
 
 class AstWhile(AstStatement):
-    def __init__(self, _body : AstGuardedProg, _term_vopt):
-        self.body = _body
-        self.term_vopt = _term_vopt
+    __slots__ = ('body', 'term_vopt')
+
+    body : AstGuardedProg
+    term_vopt : AstVOpt
+
+    def __init__(self, _body : AstGuardedProg, _term_vopt : AstVOpt):
+        self._init(body = _body, term_vopt = _term_vopt, 
+                   _hash = hash((str_hash("AstWhile"), _body, _term_vopt)))
+    
+    def __reduce__(self):
+        return (AstWhile, (self.body, self.term_vopt))
 
     def to_str_prefix(self, pre: str) -> str:
         r = pre + "while \n"
@@ -227,18 +507,32 @@ class AstWhile(AstStatement):
         r += pre + "  " + '# ' + str(self.term_vopt) + ' ' + '->' + " end"
         return r
     
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
-        if not isinstance(other, AstWhile):
+        if self is other:
+            return True
+        if not isinstance(other, AstWhile) or self._hash != other._hash:
             return False
 
         return self.body == other.body and self.term_vopt == other.term_vopt
         
 
 class AstParallel(AstStatement):
-    def __init__(self, _ls : List[AstStatement]):
-        self.ls = _ls
+    __slots__ = ('ls',)
+
+    ls : Tuple[AstStatement, ...]
+
+    def __init__(self, _ls : Sequence[AstStatement]):
+        ls = tuple(_ls)
+        self._init(ls = ls, _hash = hash((str_hash("AstParallel"),) + ls))
+    
+    def __reduce__(self):
+        return (AstParallel, (self.ls,))
+
     def appended(self, seq : AstStatement) -> AstParallel:
-        return AstParallel(self.ls + [seq])
+        return AstParallel(self.ls + (seq,))
     
     def to_str_prefix(self, pre : str) -> str:
         r = pre + "{ \n"
@@ -248,8 +542,13 @@ class AstParallel(AstStatement):
         r += pre + "}"
         return r
     
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
-        if not isinstance(other, AstParallel):
+        if self is other:
+            return True
+        if not isinstance(other, AstParallel) or self._hash != other._hash:
             return False
 
         return self.ls == other.ls
@@ -263,9 +562,33 @@ class AstParallel(AstStatement):
             return new_ls[0]
         return AstParallel(new_ls)
     
+    def replaced(self, i, prog : AstStatement) -> AstParallel:
+        '''
+            replace the parallel component with [prog] and return the resulting new program
+            (the other components are shared)
+        '''
+        return AstParallel(self.ls[:i] + (prog,) + self.ls[i+1:])
+    
+    def canonical(self) -> AstParallel:
+        '''
+            the canonical form of the components as a multiset, in which they are sorted by 
+            their (process-stable) hashes
+        '''
+        ls = tuple(sorted(self.ls, key = hash))
+        if all(a is b for a, b in zip(ls, self.ls)):
+            return self
+        return AstParallel(ls)
+    
 class AstAtom(AstStatement):
+    __slots__ = ('prog',)
+
+    prog : AstStatement
+
     def __init__(self, _prog : AstStatement):
-        self.prog = _prog
+        self._init(prog = _prog, _hash = hash((str_hash("AstAtom"), _prog)))
+    
+    def __reduce__(self):
+        return (AstAtom, (self.prog,))
     
     def to_str_prefix(self, pre : str) -> str:
         r = pre + "<\n"
@@ -273,7 +596,71 @@ class AstAtom(AstStatement):
         r += pre + ">"
         return r
     
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
-        if not isinstance(other, AstAtom):
+        if self is other:
+            return True
+        if not isinstance(other, AstAtom) or self._hash != other._hash:
             return False
         return self.prog == other.prog
+
+
+######################################################
+# flat form
+
+def ast_flatten(roots : Sequence[AstNode]) -> Tuple[List[Tuple], List[int]]:
+    '''
+        Flatten the syntax trees into a table of nodes, without recursion.
+        Every entry is (constructor, arguments), where the components are replaced by their
+        positions in the table. Components come before the nodes using them, and shared 
+        subtrees are stored once.
+        Return the table and the positions of [roots].
+    '''
+    index : Dict[int, int] = {}
+    table : List[Tuple] = []
+
+    def encode(arg):
+        if isinstance(arg, AstNode):
+            return index[id(arg)]
+        elif isinstance(arg, tuple):
+            return tuple(encode(item) for item in arg)
+        return arg
+
+    for root in roots:
+        stack : List[AstNode] = [root]
+        while len(stack) > 0:
+            node = stack[-1]
+            if id(node) in index:
+                stack.pop()
+                continue
+
+            pending = [c for c in node.components() if id(c) not in index]
+            if len(pending) > 0:
+                stack += pending
+                continue
+
+            stack.pop()
+            ctor, args = node.__reduce__()
+            index[id(node)] = len(table)
+            table.append((ctor, tuple(encode(arg) for arg in args)))
+
+    return table, [index[id(root)] for root in roots]
+
+def ast_unflatten(table : List[Tuple]) -> List[AstNode]:
+    '''
+        Rebuild the nodes from the table of ast_flatten, in the order of the table.
+    '''
+    nodes : List[AstNode] = []
+
+    def decode(arg):
+        if isinstance(arg, int):
+            return nodes[arg]
+        elif isinstance(arg, tuple):
+            return tuple(decode(item) for item in arg)
+        return arg
+    
+    for ctor, args in table:
+        nodes.append(ctor(*(decode(arg) for arg in args)))
+    return nodes
@@ -7,6 +7,7 @@
 from __future__ import annotations
 from typing import Any, List
 
+import os
 import ply.yacc as yacc
 
 from .vlexer import tokens, lexer
@@ -226,5 +227,31 @@ def p_error(p):
     raise Exception("Syntax error in input: '" + str(p.value) + "'. (" + str(p.lineno) + ", " + str(p.lexpos) + ")")
 
 
-# Build the lexer
-parser = yacc.yacc()
\ No newline at end of file
+# Build the parser
+# The parser is built on the first use, from the tables prebuilt in [parsetab], and nothing is 
+# written at runtime. After changing the grammar, regenerate the tables with 
+#     python -c "from yamata.qparsing.vparser import build_parser; build_parser(True)"
+_parser : yacc.LRParser | None = None
+
+def build_parser(write_tables : bool = False) -> yacc.LRParser:
+    parser = yacc.yacc(tabmodule = "parsetab", write_tables = write_tables, debug = False)
+    if write_tables:
+        # ply writes the tables with LF, while the repository keeps CRLF
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parsetab.py")
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(data.replace(b"\r\n", b"\n").replace(b"\n", b"\r\n"))
+    return parser
+
+def get_parser() -> yacc.LRParser:
+    global _parser
+    if _parser is None:
+        _parser = build_parser()
+    return _parser
+
+def __getattr__(name : str) -> Any:
+    # [parser] stays available as a module attribute
+    if name == "parser":
+        return get_parser()
+    raise AttributeError("module '" + __name__ + "' has no attribute '" + name + "'")
\ No newline at end of file
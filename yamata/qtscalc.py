@@ -3,13 +3,42 @@
 '''
 
 from __future__ import annotations
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Callable, Iterable, TypeVar, TYPE_CHECKING
 
 
 from .backend import *
 from .flowchart.flowchart import *
 
-from graphviz import Digraph
+# graphviz is only imported for drawing
+if TYPE_CHECKING:
+    from graphviz import Digraph
+
+T = TypeVar('T')
+
+# up to this number of density operators, the repeated ones are found by a linear scan
+DEDUP_SCAN = 16
+
+def rho_dedup(rho_ls : Iterable[VMat]) -> List[VMat]:
+    '''
+        the density operators without the repeated ones (equal within the tolerance), in order.
+        Long lists are deduplicated through a VTermIndex, in near-linear time.
+    '''
+    rho_ls = list(rho_ls)
+    res_ls : List[VMat] = []
+    if len(rho_ls) <= DEDUP_SCAN:
+        for rho in rho_ls:
+            if not any(rho == res for res in res_ls):
+                res_ls.append(rho)
+        return res_ls
+
+    index = VTermIndex()
+    for rho in rho_ls:
+        if index.find(rho) is None:
+            index.add(rho, True)
+            res_ls.append(rho)
+    return res_ls
+
+
 
 class Qts:
     '''
@@ -29,29 +58,82 @@ class Qts:
     def opt_apply(self, vo : VSuperOpt | VMat) -> Qts:
         raise NotImplementedError()
     
+    def subs(self) -> List[Qts]:
+        '''
+        the sub quantum tree states
+        '''
+        return []
+
+    def nodes(self) -> List[Qts]:
+        '''
+        all the nodes reachable from this one, every shared node once, with the sub nodes 
+        before their parents
+        '''
+        order : List[Qts] = []
+        done = set()
+        stack : List[Tuple[Qts, bool]] = [(self, False)]
+        while len(stack) > 0:
+            qts, visited = stack.pop()
+            if visited:
+                order.append(qts)
+                continue
+            if qts.id in done:
+                continue
+            done.add(qts.id)
+            stack.append((qts, True))
+            for sub in reversed(qts.subs()):
+                if sub.id not in done:
+                    stack.append((sub, False))
+        return order
+    
     def show(self, output = "qts") -> None:
         '''
-        output the quantum tree state in a diagram
+        output the quantum tree state in a diagram. Shared nodes are drawn once.
         '''
+        from graphviz import Digraph
         dot = Digraph()
 
         dot.node('-0', '', shape = 'none')
         dot.edge('-0', str(self.id))
 
-        self._layout(dot)
+        for qts in self.nodes():
+            qts._layout(dot)
+            for sub in qts.subs():
+                dot.edge(str(qts.id), str(sub.id))
 
         dot.render(output)
 
 
     def _layout(self, dot : Digraph) -> None:
         '''
-        layout in a diagram
+        layout this node in a diagram
         '''
         raise NotImplementedError()
     
     def reduce(self) -> QtsRho | QtsNondet:
         '''
-        return the reduced quantum tree state
+        return the reduced quantum tree state. Shared nodes are reduced once.
+        '''
+        nodes = self.nodes()
+
+        # the number of parents of every node, to release the reduced ones no longer needed
+        parents : Dict[int, int] = {}
+        for qts in nodes:
+            for sub in qts.subs():
+                parents[sub.id] = parents.get(sub.id, 0) + 1
+
+        reduced : Dict[int, QtsRho | QtsNondet] = {}
+        for qts in nodes:
+            reduced[qts.id] = qts._reduce([reduced[sub.id] for sub in qts.subs()])
+            for sub in qts.subs():
+                parents[sub.id] -= 1
+                if parents[sub.id] == 0:
+                    del reduced[sub.id]
+        return reduced[self.id]
+    
+    def _reduce(self, subs : List[QtsRho | QtsNondet]) -> QtsRho | QtsNondet:
+        '''
+        return the reduced node, from the reduced sub nodes
         '''
         raise NotImplementedError()
 
@@ -69,7 +151,7 @@ class QtsRho(Qts):
         if isinstance(vo, VSuperOpt):
             return QtsRho(self.rho.SOapply(vo))
         elif isinstance(vo, VMat):
-            return QtsRho(vo.mul(self.rho, False).mul(vo.dagger()))
+            return QtsRho(self.rho.Oapply(vo))
         else:
             raise Exception()
         
@@ -77,7 +159,7 @@ class QtsRho(Qts):
         dot.node(str(self.id), str(self.rho), style = "filled",
                  shape = 'box', fontname = "Arial")
 
-    def reduce(self) -> QtsRho | QtsNondet:
+    def _reduce(self, subs : List[QtsRho | QtsNondet]) -> QtsRho | QtsNondet:
         return self
 
 
@@ -89,6 +171,9 @@ class QtsNondet(Qts):
         super().__init__()
         self.ls = _ls
 
+    def subs(self) -> List[Qts]:
+        return self.ls
+
     def opt_apply(self, vo: VSuperOpt | VMat) -> Qts:
         return QtsNondet([qts.opt_apply(vo) for qts in self.ls])
     
@@ -96,26 +181,16 @@ class QtsNondet(Qts):
         dot.node(str(self.id), '', shape = "square", width= '0.3',
                  style='filled, bold', fillcolor='lightyellow')
 
-        for sub in self.ls:
-            dot.edge(str(self.id), str(sub.id))
-            sub._layout(dot)
-
-    def reduce(self) -> QtsRho | QtsNondet:
+    def _reduce(self, subs : List[QtsRho | QtsNondet]) -> QtsRho | QtsNondet:
         new_ls : List[QtsRho] = []
-        for qts in self.ls:
-            qts_r = qts.reduce()
+        for qts_r in subs:
             if isinstance(qts_r, QtsRho):
                 new_ls.append(qts_r)
             else:
                 new_ls = new_ls + qts_r.ls  # type: ignore
 
         # filter out repeated items
-        res_ls : List[VMat] = []
-        for qtsrho in new_ls:
-            if qtsrho.rho not in res_ls:
-                res_ls.append(qtsrho.rho)
-
-        return QtsNondet([QtsRho(rho) for rho in res_ls])
+        return QtsNondet([QtsRho(rho) for rho in rho_dedup(qtsrho.rho for qtsrho in new_ls)])
 
 class QtsProb(Qts):
     '''
@@ -125,6 +200,9 @@ class QtsProb(Qts):
         super().__init__()
         self.ls = _ls
 
+    def subs(self) -> List[Qts]:
+        return self.ls
+
     def opt_apply(self, vo: VSuperOpt | VMat) -> Qts:
         return QtsProb([qts.opt_apply(vo) for qts in self.ls])
     
@@ -132,15 +210,10 @@ class QtsProb(Qts):
         dot.node(str(self.id), '', shape='circle', width= '0.3',
                  style='filled, bold', fillcolor='lightblue')
 
-        for sub in self.ls:
-            dot.edge(str(self.id), str(sub.id))
-            sub._layout(dot)
-
-    def reduce(self) -> QtsRho | QtsNondet:
+    def _reduce(self, subs : List[QtsRho | QtsNondet]) -> QtsRho | QtsNondet:
         rho_ls = [VMat.zeroMat()]
 
-        for qts in self.ls:
-            qts_r = qts.reduce()
+        for qts_r in subs:
             if isinstance(qts_r, QtsRho):
                 rho_ls = [rho + qts_r.rho for rho in rho_ls]
             elif isinstance(qts_r, QtsNondet):
@@ -151,17 +224,12 @@ class QtsProb(Qts):
                         new_rho_ls += [next_qts.rho + rho for rho in rho_ls]
                     else:
                         raise Exception()
-                rho_ls = new_rho_ls
+                # filter out repeated items before the next product
+                rho_ls = rho_dedup(new_rho_ls)
             else:
                 raise Exception()
             
-        # filter out repeated items
-        res_ls : List[VMat] = []
-        for rho in rho_ls:
-            if rho not in res_ls:
-                res_ls.append(rho)
-
-        return QtsNondet([QtsRho(rho) for rho in res_ls])
+        return QtsNondet([QtsRho(rho) for rho in rho_dedup(rho_ls)])
 
 
 
@@ -170,9 +238,70 @@ k0b0 = np.array([[1., 0.], [0., 0.]])
 k0b1 = np.array([[0., 1.], [0., 0.]])
 
 
-def qtscalc_iter(v : Vertex, qts : Qts, step_bound : int, optlib : OptEnv) -> Qts:
+def vertex_branches(v : Vertex, optlib : OptEnv) \
+        -> Tuple[type | None, List[Tuple[Vertex, VSuperOpt | VMat | None]]]:
+    '''
+        the branches of one step at the non-terminal vertex [v], as (next vertex, operator) 
+        where None is the identity, and their combinator : QtsNondet, QtsProb, or None for 
+        a single branch. Abort has no branch.
+    '''
+    if isinstance(v, PVertex):
+        return QtsNondet, [(e.B, None) for e in v.outE]
+    
+    if isinstance(v, MVertex):
+        branches : List[Tuple[Vertex, VSuperOpt | VMat | None]] = []
+        for e in v.outE:
+            if not isinstance(e, MEdge):
+                raise Exception()
+            branches.append((e.B, mopt_eval(e.vopt, optlib)))
+        return QtsProb, branches
+    
+    if len(v.outE) == 1:
+        e = v.outE[0]
+        if isinstance(e, UEdge):
+            return None, [(e.B, uopt_eval(e.vopt, optlib))]
+        
+        if isinstance(e, AEdge):
+            return None, []
+        
+        if isinstance(e, IdEdge):
+            return None, [(e.B, None)]
+        
+        if isinstance(e, InitEdge):
+            # prepare all the initialization operators
+            opt_ls = [VMat.idMat()]
+            for q in e.qvar.ls:
+                opt_ls = [opt.mul(VMat(QVar([q]), k0b0)) for opt in opt_ls]\
+                        + [opt.mul(VMat(QVar([q]), k0b1)) for opt in opt_ls]
+            return None, [(e.B, VSuperOpt(opt_ls))]
+        
+    # if other situation happens 
+    raise Exception()
+
+
+def rho_apply(rho : VMat, opt : VSuperOpt | VMat | None) -> VMat:
+    if opt is None:
+        return rho
+    if isinstance(opt, VSuperOpt):
+        return rho.SOapply(opt)
+    return rho.Oapply(opt)
+
+
+def rho_branches(v : Vertex, rho : VMat, optlib : OptEnv) \
+        -> Tuple[type | None, List[Tuple[Vertex, VMat]]]:
+    '''
+        the branches of one step at the non-terminal vertex [v] on [rho], as (next vertex, rho),
+        and their combinator (see vertex_branches)
+    '''
+    comb, branches = vertex_branches(v, optlib)
+    return comb, [(u, rho_apply(rho, opt)) for u, opt in branches]
+
+
+def qtscalc_iter(v : Vertex, qts : Qts, step_bound : int, optlib : OptEnv, 
+                 fc : Flowchart | None = None) -> Qts:
     '''
         iterative procedure for quantum tree state calculation
+        fc : the flowchart of [v], to expand the vertices of lazy flowcharts on the way
     '''
     if isinstance(v, TVertex):
         return qts
@@ -180,57 +309,339 @@ def qtscalc_iter(v : Vertex, qts : Qts, step_bound : int, optlib : OptEnv) -> Qt
     if step_bound == 0:
         return Qts.bottom()
     
-    else:
-        if isinstance(v, PVertex):
-            qts_ls : List[Qts] = []
-            for e in v.outE:
-                qts_ls.append(qtscalc_iter(e.B, qts, step_bound-1, optlib))
-            return QtsNondet(qts_ls)
-        
-        if isinstance(v, MVertex):
-            qts_ls : List[Qts] = []
-            for e in v.outE:
-                if not isinstance(e, MEdge):
-                    raise Exception()
-                mopt = mopt_eval(e.vopt, optlib)
-                qts_ls.append(qtscalc_iter(e.B, qts.opt_apply(mopt), step_bound-1, optlib))
-            return QtsProb(qts_ls)
+    if fc is not None:
+        fc.expand(v)
+
+    comb, branches = vertex_branches(v, optlib)
+    if len(branches) == 0:
+        return Qts.bottom()
+    
+    qts_ls = [qtscalc_iter(u, qts if opt is None else qts.opt_apply(opt), step_bound-1, optlib, fc)
+              for u, opt in branches]
+    if comb is None:
+        return qts_ls[0]
+    return comb(qts_ls)
+
+
+def qtscalc_memo(v : Vertex, rho : VMat, step_bound : int, optlib : OptEnv, fc : Flowchart | None,
+                 leaf : Callable[[VMat], T], bottom : T, 
+                 combine : Callable[[type, List[T]], T], 
+                 prune : Callable[[type | None, VMat], T | None] | None = None) -> T:
+    '''
+        The memoized calculation without recursion, of the results of type [T] built by
+            leaf : the result of a density operator at a terminal vertex,
+            bottom : the result of abort and of running out of steps,
+            combine : the combination of the results of the branches by QtsNondet or QtsProb.
+        The results are memoized for the same vertex, remaining steps and density operator
+        (equal within the tolerance). If [prune] is designated, it is called on the density 
+        operator of every branch with the combinator of the branches, and the branch is not 
+        calculated further if a result is returned.
+        The graph of the keys is explored first, counting the parents of every key. Then the 
+        results are calculated in post-order, and released once all their parents have used 
+        them, so that only the results still waiting for a parent are kept, beside the graph.
+        fc : the flowchart of [v], to expand the vertices of lazy flowcharts on the way
+    '''
+    # the density operators met, numbered through the index
+    rho_index = VTermIndex()
+    rhos : List[VMat] = []
+    def rho_id(rho : VMat) -> int:
+        i = rho_index.find(rho)
+        if i is None:
+            i = len(rhos)
+            rhos.append(rho)
+            rho_index.add(rho, i)
+        return i
+    
+    # (vertex, remaining steps, rho id) -> the result
+    Key = Tuple[Vertex | None, int, int]
+    memo : Dict[Key, T] = {}
+
+    def key_of(comb : type | None, u : Vertex, bound : int, rho : VMat) -> Key:
+        if prune is not None:
+            res = prune(comb, rho)
+            if res is not None:
+                key = (None, -1, rho_id(rho))
+                memo[key] = res
+                return key
+        return (u, bound, rho_id(rho))
+
+    # the branches of every key, and the number of its parents
+    root = key_of(None, v, step_bound, rho)
+    graph : Dict[Key, Tuple[type | None, List[Key]]] = {}
+    parents : Dict[Key, int] = {}
+    stack = [root]
+    while len(stack) > 0:
+        key = stack.pop()
+        if key in graph or key in memo:
+            continue
+
+        u, bound, i = key
+        if isinstance(u, TVertex) or bound == 0:
+            graph[key] = (None, [])
+            continue
+
+        if fc is not None:
+            fc.expand(u)
+        comb, branches = rho_branches(u, rhos[i], optlib)
+        sub_keys = [key_of(comb, w, bound - 1, r) for w, r in branches]
+        graph[key] = (comb, sub_keys)
+        for k in sub_keys:
+            parents[k] = parents.get(k, 0) + 1
+            stack.append(k)
+
+    leaves : Dict[int, T] = {}
+    stack = [root]
+    while len(stack) > 0:
+        key = stack[-1]
+        if key in memo:
+            stack.pop()
+            continue
+
+        u, bound, i = key
+        comb, sub_keys = graph[key]
+        if isinstance(u, TVertex):
+            if i not in leaves:
+                leaves[i] = leaf(rhos[i])
+            memo[key] = leaves[i]
+            stack.pop()
+            continue
+
+        todo = [k for k in sub_keys if k not in memo]
+        if len(todo) > 0:
+            stack.extend(reversed(todo))
+            continue
+
+        stack.pop()
+        subs = [memo[k] for k in sub_keys]
+        if len(subs) == 0:
+            memo[key] = bottom
+        elif comb is None:
+            memo[key] = subs[0]
+        else:
+            memo[key] = combine(comb, subs)
+
+        # release the results used by all their parents
+        del graph[key]
+        for k in sub_keys:
+            parents[k] -= 1
+            if parents[k] == 0:
+                del memo[k]
+
+    return memo[root]
+
+
+def qtscalc_dag(v : Vertex, rho : VMat, step_bound : int, optlib : OptEnv, 
+                fc : Flowchart | None = None) -> Qts:
+    '''
+        The memoized quantum tree state calculation (see qtscalc_memo). The nodes are also 
+        hash-consed, so that the quantum tree state is a DAG.
+    '''
+    combs : Dict[Tuple[type, Tuple[int, ...]], Qts] = {}
+    def combine(comb : type, subs : List[Qts]) -> Qts:
+        key = (comb, tuple(sub.id for sub in subs))
+        if key not in combs:
+            combs[key] = comb(subs)
+        return combs[key]
+
+    return qtscalc_memo(v, rho, step_bound, optlib, fc, QtsRho, Qts.bottom(), combine)
+
+
+def rho_combine(comb : type, subs : List[Tuple[bool, List[VMat]]]) -> Tuple[bool, List[VMat]]:
+    '''
+        the combination by QtsNondet or QtsProb of the flat sets of density operators, each as 
+        the flag of a single leaf and the list. The branches of QtsProb are summed up and the 
+        repeated sums are removed at every branch.
+    '''
+    if comb is QtsNondet:
+        return False, rho_dedup(rho for _, rho_ls in subs for rho in rho_ls)
+    
+    zero = VMat.zeroMat()
+    rho_ls = [zero]
+    for _, sub_ls in subs:
+        # nothing to add for the branches of zero trace only
+        if len(sub_ls) == 1 and np.real(sub_ls[0].trace()) < zero.eps:
+            continue
+        rho_ls = rho_dedup(sub + rho for sub in sub_ls for rho in rho_ls)
+    return False, rho_ls
+
+
+def qtscalc_reduced(v : Vertex, rho : VMat, step_bound : int, optlib : OptEnv, 
+                    fc : Flowchart | None = None) -> QtsRho | QtsNondet:
+    '''
+        The memoized calculation of the reduced quantum tree state (see qtscalc_memo), without
+        building the tree. For every (vertex, remaining steps, rho), the result is the flat set 
+        of density operators, as the flag of a single leaf and the list (see rho_combine), and 
+        the zero trace branches are dropped immediately.
+    '''
+    Res = Tuple[bool, List[VMat]]
+
+    def prune(comb : type | None, rho : VMat) -> Res | None:
+        if np.real(rho.trace()) < rho.eps:
+            return bottom
+        return None
+    
+    bottom : Res = (True, [VMat.zeroMat()])
+    single, rho_ls = qtscalc_memo(v, rho, step_bound, optlib, fc, 
+                                  lambda rho : (True, [rho]), bottom, rho_combine, prune)
+    if single:
+        return QtsRho(rho_ls[0])
+    return QtsNondet([QtsRho(rho) for rho in rho_ls])
+
+
+def rho_merge(rho_ls : List[VMat], radius : float) -> Tuple[List[VMat], float]:
+    '''
+        The density operators, where the ones within the trace distance [radius] of a former
+        one are merged into it, and the largest trace distance merged. The trace distance is
+        bounded by sqrt(d) times the Frobenius distance for the dimension d, and this bound is 
+        compared with [radius]. Long lists are merged by the same criterion, with the candidates 
+        found through a VTermIndex of the entrywise tolerance radius / sqrt(d), which every pair 
+        within the bound satisfies.
+    '''
+    if len(rho_ls) == 0:
+        return rho_ls, 0.
+    
+    dim = max(rho.mat.shape[0] for rho in rho_ls)
+    def dist(a : VMat, b : VMat) -> float:
+        return float(np.sqrt(dim) * np.linalg.norm((a - b).mat))
+    
+    res_ls : List[VMat] = []
+    error = 0.
+    if len(rho_ls) <= DEDUP_SCAN:
+        for rho in rho_ls:
+            for res in res_ls:
+                d = dist(rho, res)
+                if d <= radius:
+                    error = max(error, d)
+                    break
+            else:
+                res_ls.append(rho)
+        return res_ls, error
+
+    index = VTermIndex(radius / np.sqrt(dim) + VTerm.eps_value)
+    for rho in rho_ls:
+        res = index.find(rho, lambda res, _ : dist(rho, res) <= radius)
+        if res is None:
+            index.add(rho, rho)
+            res_ls.append(rho)
+        else:
+            error = max(error, dist(rho, res))
+    return res_ls, error
+
+
+def qtscalc_approx(v : Vertex, rho : VMat, step_bound : int, optlib : OptEnv, threshold : float,
+                   fc : Flowchart | None = None, scale : float = 1.) -> Tuple[QtsRho | QtsNondet, float]:
+    '''
+        The reduced quantum tree state calculated as in qtscalc_reduced, approximated by 
+            pruning the measurement branches of traces below [threshold], as zero,
+            merging the density operators within the trace distance [threshold] (see rho_merge).
+        Return the result and the bound of its error in trace norm: every density operator of 
+        the exact result is within this distance of one in the result, and vice versa. 
+        The error of a pruned branch is its trace, which bounds all the density operators it 
+        leads to. The errors are summed up over the branches of QtsProb, and maximized over 
+        the ones of QtsNondet, with the distances merged at every combination added.
+        scale : the factor of [rho] over the initial state of the user, 2^k if it is extended 
+            by the identity on k qubits. The threshold and the error are in the scale of the 
+            initial state, i.e. the traces and distances of the results divided by [scale].
+    '''
+    zero = VMat.zeroMat()
+    Res = Tuple[bool, List[VMat], float]
+    radius = threshold * scale
+
+    def combine(comb : type, subs : List[Res]) -> Res:
+        if comb is QtsNondet:
+            rho_ls, error = rho_merge([rho for _, sub_ls, _ in subs for rho in sub_ls], radius)
+            return False, rho_ls, max(sub_error for _, _, sub_error in subs) + error
         
-        if len(v.outE) == 1:
-            e = v.outE[0]
-            if isinstance(e, UEdge):
-                uopt = uopt_eval(e.vopt, optlib)
-                return qtscalc_iter(e.B, qts.opt_apply(uopt), step_bound-1, optlib)
-            
-            if isinstance(e, AEdge):
-                return Qts.bottom()
-            
-            if isinstance(e, IdEdge):
-                return qtscalc_iter(e.B, qts, step_bound-1, optlib)
-            
-            if isinstance(e, InitEdge):
-                # prepare all the initialization operators
-                opt_ls = [VMat.idMat()]
-                for q in e.qvar.ls:
-                    opt_ls = [opt.mul(VMat(QVar([q]), k0b0)) for opt in opt_ls]\
-                            + [opt.mul(VMat(QVar([q]), k0b1)) for opt in opt_ls]
-                    
-                return qtscalc_iter(e.B, 
-                            qts.opt_apply(VSuperOpt(opt_ls)), 
-                            step_bound-1, optlib)
-            
-        # if other situation happens 
-        raise Exception()
+        rho_ls = [zero]
+        error = 0.
+        for _, sub_ls, sub_error in subs:
+            error += sub_error
+            # nothing to add for the branches of zero trace only
+            if len(sub_ls) == 1 and np.real(sub_ls[0].trace()) < zero.eps:
+                continue
+            rho_ls = rho_dedup(sub + rho for sub in sub_ls for rho in rho_ls)
+        rho_ls, merge_error = rho_merge(rho_ls, radius)
+        return False, rho_ls, error + merge_error
+    
+    def prune(comb : type | None, rho : VMat) -> Res | None:
+        trace = float(np.real(rho.trace()))
+        if trace < rho.eps or (comb is QtsProb and trace < radius):
+            return True, [zero], max(trace, 0.)
+        return None
     
+    single, rho_ls, error = qtscalc_memo(v, rho, step_bound, optlib, fc, 
+                                         lambda rho : (True, [rho], 0.), (True, [zero], 0.), 
+                                         combine, prune)
+    if single:
+        return QtsRho(rho_ls[0]), error / scale
+    return QtsNondet([QtsRho(rho) for rho in rho_ls]), error / scale
 
-def qtscalc(fc : Flowchart, rhoinit : VMat, step_bound = 30) -> Qts:
+
+class ApproxQts:
+    '''
+    The approximate reduced quantum tree state, within the error budget.
+        qts : the reduced quantum tree state
+        error : the bound of the error in trace norm, in the scale of the initial state 
+            (see qtscalc_approx)
+        threshold : the threshold of pruning and merging used
+        rounds : the number of calculations until the error is within the budget
+    '''
+    def __init__(self, _qts : QtsRho | QtsNondet, _error : float, _threshold : float, _rounds : int):
+        self.qts = _qts
+        self.error = _error
+        self.threshold = _threshold
+        self.rounds = _rounds
+
+    def __str__(self) -> str:
+        return "approximate quantum tree state: error <= %g (threshold %g, %d rounds)" \
+            % (self.error, self.threshold, self.rounds)
+
+
+def qtscalc_budget(v : Vertex, rho : VMat, step_bound : int, optlib : OptEnv, error_budget : float,
+                   fc : Flowchart | None = None, scale : float = 1.) -> ApproxQts:
+    '''
+        The approximate calculation (see qtscalc_approx) with the error bound within [error_budget].
+        It starts from the threshold [error_budget], and calculates again with a smaller threshold
+        while the error bound is over the budget. The threshold stops decreasing at the tolerance,
+        where the error bound is reported even if it is over the budget.
+        scale : the factor of [rho] over the initial state (see qtscalc_approx)
+    '''
+    if error_budget <= 0:
+        raise ValueError("The error budget should be positive.")
+    
+    threshold = error_budget
+    rounds = 0
+    while True:
+        qts, error = qtscalc_approx(v, rho, step_bound, optlib, threshold, fc, scale)
+        rounds += 1
+        if error <= error_budget or threshold <= rho.eps:
+            return ApproxQts(qts, error, threshold, rounds)
+        threshold = max(threshold * min(0.5, error_budget / (2 * error)), rho.eps)
+
+
+def qtscalc(fc : Flowchart, rhoinit : VMat, step_bound = 30, memo = False, 
+            reduce = False, error_budget : float | None = None) -> Qts | ApproxQts:
     '''
         calculate the quantum tree state approximation 
         within [step_bound] steps
+        memo : calculate the shared quantum tree state DAG (see qtscalc_dag) instead of the tree
+        reduce : calculate the reduced quantum tree state directly (see qtscalc_reduced), 
+            which is the same as qtscalc(...).reduce()
+        error_budget : calculate the reduced quantum tree state approximately, with the error 
+            bound in trace norm within the budget (see qtscalc_budget), as an ApproxQts
     '''
     if not (VMat.zeroMat() <= rhoinit) or np.real(rhoinit.trace()) > 1 + rhoinit.eps:
         raise ValueError("Invalid partial density operator.")
     
-    return qtscalc_iter(fc.vertices[0], QtsRho(rhoinit), step_bound, fc.optlib)
-
-    
+    # allocate the state on the whole register once
+    reg = rhoinit.qvar + fc.register
+    if error_budget is not None:
+        # the extension by the identity multiplies the traces by 2 for every qubit added, 
+        # and the budget is in the scale of [rhoinit]
+        return qtscalc_budget(fc.vertices[0], rhoinit.extend_to(reg), step_bound, fc.optlib, 
+                              error_budget, fc, 2.**(len(reg) - len(rhoinit.qvar)))
+    if reduce:
+        return qtscalc_reduced(fc.vertices[0], rhoinit.extend_to(reg), step_bound, fc.optlib, fc)
+    if memo:
+        return qtscalc_dag(fc.vertices[0], rhoinit.extend_to(reg), step_bound, fc.optlib, fc)
+    return qtscalc_iter(fc.vertices[0], QtsRho(rhoinit.extend_to(reg)), step_bound, fc.optlib, fc)
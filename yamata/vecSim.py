@@ -4,133 +4,188 @@
 
 
 from __future__ import annotations
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Iterable
 
 from .backend import *
 from .flowchart.flowchart import *
+from .flowchart.plan import *
 
 import random
-from tqdm import tqdm
 
 M0 = np.array([[1., 0.], [0., 0.]])
 M1 = np.array([[0., 0.], [0., 1.]])
 X = np.array([[0., 1.], [1., 0.]])
 
+def progress_range(n : int, desc : str, progress : bool) -> Iterable[int]:
+    '''
+        range(n), with a progress bar if [progress] (tqdm is only imported then)
+    '''
+    if not progress:
+        return range(n)
+    
+    from tqdm import tqdm
+    return tqdm(range(n), desc = desc)
+
+def norm2(stt : np.ndarray) -> float:
+    '''
+        return the square of the norm of the state tensor
+    '''
+    return float(np.real(np.vdot(stt, stt)))
+
+def plan_next(plan : ExecPlan, vid : int, stt : np.ndarray, rng : np.random.Generator | None = None)\
+      -> Tuple[int, np.ndarray]:
+    '''
+        Conduct one step of calculation at vertex [vid] on the state tensor [stt] (in plan.shape).
+        Return the next vertex id and state. The vertex id -1 means the machine terminates, 
+        and the state is kept unchanged.
+        rng : the random generator for the choices. The global one is used if not designated.
+    '''
+    if plan.op[vid] == OP_UNEXPANDED:
+        plan.expand(vid)
+    op = plan.op[vid]
+
+    if op == OP_UNITARY:
+        axes, mat = plan.opt[vid]
+        return plan.succ[vid][0], tensor_apply(stt, mat, axes)
+    
+    if op == OP_ID:
+        return plan.succ[vid][0], stt
+    
+    if op == OP_PARALLEL:
+        # make an arbitrary choice
+        succ = plan.succ[vid]
+        if rng is None:
+            return random.choice(succ), stt
+        return succ[rng.integers(len(succ))], stt
+    
+    if op == OP_MEASURE:
+        # calculate probabilities
+        prob : List[float] = []
+        mea_stt : List[np.ndarray] = []
+        for axes, mat in plan.opt[vid]:
+            w = tensor_apply(stt, mat, axes)
+            mea_stt.append(w)
+            prob.append(norm2(w))
+
+        # make a sampling
+        res = sampling(prob, rng)
+
+        # unterminated state
+        if res == -1:
+            return -1, stt
+        
+        return plan.succ[vid][res], mea_stt[res] / np.sqrt(prob[res])
+    
+    if op == OP_INIT:
+        # Note: initialization is interpreted as multiple [if - skip - X gate] statements
+        for axis, kraus in plan.opt[vid]:
+            w0 = tensor_apply(stt, kraus[0], (axis,))
+            w1 = tensor_apply(stt, kraus[1], (axis,))
+            prob = [norm2(w0), norm2(w1)]
+
+            # make a sampling
+            if sampling(prob, rng) == 0:
+                stt = w0 / np.sqrt(prob[0])
+            else:
+                stt = w1 / np.sqrt(prob[1])
+
+        return plan.succ[vid][0], stt
+
+    # OP_TERM and OP_ABORT : stop
+    return -1, stt
+
+
 class MachineState:
     def __init__(self, _vstate : VVec, _vertex : Vertex):
         self.vstate = _vstate
         self.vertex = _vertex
 
-    def next(self, fc : Flowchart) -> MachineState | None:
+    def next(self, fc : Flowchart, rng : np.random.Generator | None = None) -> MachineState | None:
         '''
             Conduct one step of calculation and return the next machine state.
             Return [None] if the machine already terminates.
+            rng : the random generator for the choices. The global one is used if not designated.
         '''
+        reg = self.vstate.qvar + fc.register
+        plan = fc.plan(reg)
 
-        # stop 
-        if isinstance(self.vertex, TVertex):
+        stt = self.vstate.extend_to(reg).vec.reshape(plan.shape)
+        vid, stt = plan_next(plan, self.vertex.id, stt, rng)
+        if vid == -1:
             return None
         
-        if len(self.vertex.outE) == 1:
-            e = self.vertex.outE[0]
-            if isinstance(e, IdEdge):
-                return MachineState(self.vstate, e.B)
-            
-            if isinstance(e, UEdge):
-                uopt = uopt_eval(e.vopt, fc.optlib)
-                return MachineState(self.vstate.Mapply(uopt), e.B)
-            
-            if isinstance(e, AEdge):
-                # directly shutdown
-                return None
-            
-            if isinstance(e, InitEdge):
-                # Note: initialization is interpreted as multiple [if - skip - X gate] statements
-                cur_v = self.vstate
-                for q in e.qvar.ls:
-                    # calculate probabilities
-                    prob : List[float] = []
-                    mea_stt : List[VVec] = []
-
-                    # M0
-                    mopt = VMat(QVar([q]), M0)
-                    v = cur_v.Mapply(mopt)
-                    mea_stt.append(v)
-                    prob.append(v.norm2())
-
-                    # M1
-                    mopt = VMat(QVar([q]), M1)
-                    v = cur_v.Mapply(mopt)
-                    mea_stt.append(v)
-                    prob.append(v.norm2())
-
-                    # make a sampling
-                    res = sampling(prob)
-
-                    # initialization
-                    if res == 0:
-                        cur_v = mea_stt[0].normalized()
-                    else:
-                        cur_v = mea_stt[1].normalized()
-                        xopt = VMat(QVar([q]), X)
-                        cur_v = cur_v.Mapply(xopt)
-
-                return MachineState(cur_v, e.B)
-
-        if isinstance(self.vertex, PVertex):
-            # make an arbitrary choice
-            e = random.choice(self.vertex.outE)
-            return MachineState(self.vstate, e.B)
-        
-        if isinstance(self.vertex, MVertex):
-            # calculate probabilities
-            prob : List[float] = []
-            mea_stt : List[VVec] = []
-
-            for i in range(len(self.vertex.outE)):
-                e = self.vertex.outE[i]
-                if not isinstance(e, MEdge):
-                    raise Exception()
-                mopt = mopt_eval(e.vopt, fc.optlib)
-                # calculate the state vectors after measurements
-                v = self.vstate.Mapply(mopt)
-                mea_stt.append(v)
-                prob.append(v.norm2())
-
-            # make a sampling
-            res = sampling(prob)
-
-            # unterminated state
-            if res == -1:
-                return None
-            
-            return MachineState(mea_stt[res].normalized(), self.vertex.outE[res].B)
-
-        raise Exception()
+        return MachineState(VVec(reg, stt.reshape((-1,))), fc.vertices[vid])
                 
 
 class VecRecord:
     '''
     One VecRecord contains all information about one vector result in a simulation experiment.
+    The running steps of the cases are kept as a histogram over 0 .. step_bound.
     '''
-    def __init__(self, _stt : VVec | None):
+    def __init__(self, _stt : VVec | None, _step_bound : int):
         self.stt = _stt
 
-        # the count of running step of all cases
-        self.step_count : List[int] = []
+        # the count of cases for every number of running steps
+        self.counts = np.zeros(_step_bound + 1, dtype = np.int64)
 
     def __len__(self) -> int:
-        return len(self.step_count)
+        return int(np.sum(self.counts))
     
-    def append(self, count : int) -> None:
-        return self.step_count.append(count)
+    @property
+    def step_count(self) -> np.ndarray:
+        '''
+            the running steps of all cases, in ascending order
+        '''
+        return np.repeat(np.arange(len(self.counts)), self.counts)
+    
+    def append(self, count : int, times : int = 1) -> None:
+        '''
+            record [times] cases which run for [count] steps
+        '''
+        self.counts[count] += times
+
+    def merge(self, other : VecRecord) -> None:
+        '''
+            add all the cases of [other] to this record
+        '''
+        self.counts += other.counts
+
+    def mean(self) -> float:
+        '''
+            the mean of running steps
+        '''
+        if len(self) == 0:
+            raise ValueError("No case recorded.")
+        return float(np.dot(np.arange(len(self.counts)), self.counts) / len(self))
+    
+    def var(self) -> float:
+        '''
+            the variance of running steps
+        '''
+        if len(self) == 0:
+            raise ValueError("No case recorded.")
+        steps = np.arange(len(self.counts))
+        return float(np.dot((steps - self.mean())**2, self.counts) / len(self))
+    
+    def percentile(self, q : float) -> int:
+        '''
+            the [q]-th percentile (0 <= q <= 100) of running steps, 
+            i.e. the least step number covering at least q% of the cases and at least one case,
+            so that q = 0 and q = 100 give the least and the greatest steps recorded
+        '''
+        if len(self) == 0:
+            raise ValueError("No case recorded.")
+        if not 0 <= q <= 100:
+            raise ValueError("The percentile should be within [0, 100]: " + str(q))
+        cum = np.cumsum(self.counts)
+        return int(np.searchsorted(cum, max(q / 100. * cum[-1], 1)))
     
     def __str__(self) -> str:
         if self.stt is None:
             label = "Unterminated"
         else:
             label = str(self.stt)
-        return label + " - " + str (len(self.step_count)) + "\n"
+        return label + " - " + str (len(self)) + "\n"
 
 class VecSimRes:
     '''
@@ -142,19 +197,93 @@ class VecSimRes:
         self.step_bound = _step_bound
 
         # Here [None] represents unterminated states
-        self.records : List[VecRecord] = [VecRecord(None)]
+        self.records : List[VecRecord] = [VecRecord(None, _step_bound)]
+
+        # the index from terminal states to their records
+        self._index = VTermIndex()
 
-    def record(self, stt : VVec|None, count : int) -> None:
+    @property
+    def records(self) -> List[VecRecord]:
+        return self._records
+    
+    @records.setter
+    def records(self, records : List[VecRecord]) -> None:
+        self._records = records
+        self._index = VTermIndex()
+        for rec in records:
+            if rec.stt is not None:
+                self._index.add(rec.stt, rec)
+
+    def find(self, stt : VVec|None) -> VecRecord:
+        '''
+            return the record of [stt]. A new record is created if it does not exist.
+        '''
+        if stt is None:
+            return self.records[0]
+        
         # if this state already exists
-        for rec in self.records:
-            if rec.stt == stt:
-                rec.append(count)
-                return
+        rec = self._index.find(stt)
+        if rec is not None:
+            return rec
 
         # if it is a new state
-        new_rec = VecRecord(stt)
+        new_rec = VecRecord(stt, self.step_bound)
         self.records.append(new_rec)
-        new_rec.append(count)
+        self._index.add(stt, new_rec)
+        return new_rec
+
+    def record(self, stt : VVec|None, count : int, times : int = 1) -> None:
+        self.find(stt).append(count, times)
+
+    def merge(self, other : VecSimRes) -> None:
+        '''
+            merge the records of [other], which is a simulation of the same setting, into this result
+        '''
+        if self.step_bound != other.step_bound:
+            raise ValueError("Cannot merge results with different step bounds.")
+
+        for rec in other.records:
+            self.find(rec.stt).merge(rec)
+
+    def save(self, path : str) -> None:
+        '''
+            save the records (and the initial state) to a compressed .npz file.
+            The flowchart is not saved.
+        '''
+        stts = [rec.stt for rec in self.records[1:]]
+        np.savez_compressed(path,
+            step_bound = np.array(self.step_bound),
+            vinit_qvar = np.array(' '.join(self.vinit.qvar.ls)),
+            vinit_vec = self.vinit.vec,
+            # the terminal states are concatenated, with their qvars and offsets
+            stt_qvar = np.array([' '.join(stt.qvar.ls) for stt in stts], dtype = str),
+            stt_ptr = np.cumsum([0] + [len(stt.vec) for stt in stts]),
+            stt_data = np.concatenate([stt.vec for stt in stts] + [np.zeros(0, dtype = complex)]),
+            counts = np.array([rec.counts for rec in self.records]))
+        
+    @staticmethod
+    def load(path : str, fc : Flowchart | None = None) -> VecSimRes:
+        '''
+            load the result saved by [save]. The flowchart can be designated by [fc].
+        '''
+        data = np.load(path, allow_pickle = False)
+
+        def qvar_of(s) -> QVar:
+            return QVar(str(s).split())
+
+        vinit = VVec(qvar_of(data['vinit_qvar']), data['vinit_vec'])
+        res = VecSimRes(fc, vinit, int(data['step_bound']))   # type: ignore
+
+        ptr = data['stt_ptr']
+        records = [VecRecord(None, res.step_bound)]
+        for i in range(len(data['stt_qvar'])):
+            stt = VVec(qvar_of(data['stt_qvar'][i]), data['stt_data'][ptr[i] : ptr[i+1]])
+            records.append(VecRecord(stt, res.step_bound))
+        for rec, counts in zip(records, data['counts']):
+            rec.counts = counts.copy()
+        res.records = records
+
+        return res
 
     def __str__(self) -> str:
         r = ""
@@ -166,16 +295,283 @@ class VecSimRes:
 
 
 
-def vecsim(fc : Flowchart, vinit : VVec, step_bound = 500, sampling_count = 1) -> VecSimRes:
+def batch_norm2(vecs : np.ndarray) -> np.ndarray:
+    '''
+        return the squares of the norms of all the state tensors in the batch
+    '''
+    return np.sum(np.real(vecs.conj() * vecs), axis = tuple(range(1, vecs.ndim)))
+
+def batch_next(plan : ExecPlan, vid : int, vecs : np.ndarray, rng : np.random.Generator)\
+      -> Tuple[np.ndarray, np.ndarray]:
+    '''
+        Conduct one step of calculation for all the state tensors in [vecs] (in the shape 
+        (batch,) + plan.shape), which are at vertex [vid].
+        Return the new states and the array of next vertex ids, 
+        where -1 means the machine terminates (and the state is kept unchanged).
+    '''
+    if plan.op[vid] == OP_UNEXPANDED:
+        plan.expand(vid)
+    op = plan.op[vid]
+    count = len(vecs)
+
+    # the axes of the states in the batch, and the broadcasting shape of numbers for every state
+    def batch_axes(axes : Tuple[int, ...]) -> Tuple[int, ...]:
+        return tuple(i + 1 for i in axes)
+    rows = (count,) + (1,) * len(plan.shape)
+
+    if op == OP_UNITARY:
+        axes, mat = plan.opt[vid]
+        return tensor_apply(vecs, mat, batch_axes(axes)), np.full(count, plan.succ[vid][0])
+    
+    if op == OP_ID:
+        return vecs, np.full(count, plan.succ[vid][0])
+    
+    if op == OP_PARALLEL:
+        # make an arbitrary choice for every state
+        succ = np.array(plan.succ[vid])
+        return vecs, succ[rng.integers(len(succ), size = count)]
+    
+    if op == OP_MEASURE:
+        # calculate probabilities
+        mea_stt = [tensor_apply(vecs, mat, batch_axes(axes)) for axes, mat in plan.opt[vid]]
+        prob = np.array([batch_norm2(w) for w in mea_stt])
+
+        # make a sampling
+        res = sampling_batch(prob, rng)
+
+        # unterminated states keep the state before measurement
+        new_vecs = vecs.copy()
+        for i in range(len(mea_stt)):
+            idx = np.flatnonzero(res == i)
+            new_vecs[idx] = mea_stt[i][idx] / np.sqrt(prob[i][idx]).reshape((-1,) + rows[1:])
+        
+        succ = np.array(plan.succ[vid] + [-1])
+        return new_vecs, succ[res]
+    
+    if op == OP_INIT:
+        # Note: initialization is interpreted as multiple [if - skip - X gate] statements
+        for axis, kraus in plan.opt[vid]:
+            w0 = tensor_apply(vecs, kraus[0], (axis + 1,))
+            w1 = tensor_apply(vecs, kraus[1], (axis + 1,))
+            prob = np.array([batch_norm2(w0), batch_norm2(w1)])
+            
+            # make a sampling
+            pick = sampling_batch(prob, rng) == 0
+            vecs = np.where(pick.reshape(rows), w0, w1) \
+                / np.sqrt(np.where(pick, prob[0], prob[1])).reshape(rows)
+
+        return vecs, np.full(count, plan.succ[vid][0])
+    
+    # OP_TERM and OP_ABORT : stop
+    return vecs, np.full(count, -1)
+
+
+def vecsim_batch(fc : Flowchart, vinit : VVec, step_bound : int, sampling_count : int,
+                 res : VecSimRes, rng : np.random.Generator, progress = True) -> None:
+    '''
+    the batched vector simulation: all the samplings are stepped together, and the
+    samplings at the same vertex are calculated in one vectorized operation.
+    '''
+    plan = fc.plan(vinit.qvar)
+
+    states = np.tile(vinit.vec, (sampling_count, 1)).reshape((sampling_count,) + plan.shape)
+    vid = np.zeros(sampling_count, dtype = int)
+
+    # the indices of the running samplings
+    alive = np.arange(sampling_count)
+
+    for step in progress_range(step_bound, "Stepping", progress):
+        if len(alive) == 0:
+            break
+
+        # group the running samplings by their vertices
+        alive = alive[np.argsort(vid[alive], kind = 'stable')]
+        groups = np.split(alive, np.flatnonzero(np.diff(vid[alive])) + 1)
+
+        for group in groups:
+            states[group], vid[group] = batch_next(plan, vid[group[0]], states[group], rng)
+
+        # record the terminated states, copied out of the batch so that it can be released
+        for i in alive[vid[alive] == -1]:
+            res.record(VVec(vinit.qvar, states[i].reshape((-1,)).copy()), step)
+        alive = alive[vid[alive] != -1]
+
+    # the unterminated states are only recorded after some steps
+    if step_bound > 0:
+        for i in alive:
+            res.record(None, step_bound)
+
+
+
+def branch_next(plan : ExecPlan, vid : int, stt : np.ndarray, count : int, rng : np.random.Generator)\
+      -> List[Tuple[np.ndarray, int, int]]:
+    '''
+        Conduct one step of calculation for [count] samplings sharing the state tensor [stt] 
+        at vertex [vid]. Return the branches as (state, next vertex id, count) tuples, where the 
+        counts are split multinomially over the outcomes. The vertex id -1 means the machine terminates.
+    '''
+    if plan.op[vid] == OP_UNEXPANDED:
+        plan.expand(vid)
+    op = plan.op[vid]
+
+    if op == OP_UNITARY:
+        axes, mat = plan.opt[vid]
+        return [(tensor_apply(stt, mat, axes), plan.succ[vid][0], count)]
+    
+    if op == OP_ID:
+        return [(stt, plan.succ[vid][0], count)]
+    
+    if op == OP_PARALLEL:
+        # make an arbitrary choice for every sampling
+        succ = plan.succ[vid]
+        counts = rng.multinomial(count, [1. / len(succ)] * len(succ))
+        return [(stt, succ[i], counts[i]) for i in range(len(succ)) if counts[i] > 0]
+    
+    if op == OP_MEASURE:
+        # calculate probabilities
+        prob : List[float] = []
+        mea_stt : List[np.ndarray] = []
+        for axes, mat in plan.opt[vid]:
+            w = tensor_apply(stt, mat, axes)
+            mea_stt.append(w)
+            prob.append(norm2(w))
+        
+        # check the distribution, the rest probability is for the unterminated situation
+        if sum(prob) > 1. + VTerm.eps_value or min(prob) < - VTerm.eps_value:
+            raise ValueError("Invalid probabilistic distribution.")
+        prob_arr = np.clip(np.array(prob + [max(1. - sum(prob), 0.)]), 0., None)
+        counts = rng.multinomial(count, prob_arr / np.sum(prob_arr))
+
+        res : List[Tuple[np.ndarray, int, int]] = []
+        for i in range(len(mea_stt)):
+            if counts[i] > 0:
+                res.append((mea_stt[i] / np.sqrt(prob[i]), plan.succ[vid][i], counts[i]))
+        if counts[-1] > 0:
+            res.append((stt, -1, counts[-1]))
+        return res
+    
+    if op == OP_INIT:
+        # Note: initialization is interpreted as multiple [if - skip - X gate] statements
+        branches = [(stt, count)]
+        for axis, kraus in plan.opt[vid]:
+            new_branches : List[Tuple[np.ndarray, int]] = []
+            for cur_v, cur_count in branches:
+                w0 = tensor_apply(cur_v, kraus[0], (axis,))
+                w1 = tensor_apply(cur_v, kraus[1], (axis,))
+                p0 = min(max(norm2(w0), 0.), 1.)
+                count0, count1 = rng.multinomial(cur_count, [p0, 1. - p0])
+
+                if count0 > 0:
+                    new_branches.append((w0 / np.sqrt(norm2(w0)), count0))
+                if count1 > 0:
+                    new_branches.append((w1 / np.sqrt(norm2(w1)), count1))
+            branches = new_branches
+
+        return [(cur_v, plan.succ[vid][0], cur_count) for cur_v, cur_count in branches]
+    
+    # OP_TERM and OP_ABORT : stop
+    return [(stt, -1, count)]
+
+
+def vecsim_branch(fc : Flowchart, vinit : VVec, step_bound : int, sampling_count : int,
+                  res : VecSimRes, rng : np.random.Generator, progress = True) -> None:
+    '''
+    the shot-branching vector simulation: one branch carries a state with the count of samplings
+    in it. Branches are split at random choices and merged when they meet with the same state
+    at the same vertex, so that every distinct branch is calculated only once.
+    '''
+    plan = fc.plan(vinit.qvar)
+
+    frontier : List[Tuple[np.ndarray, int, int]] = [(vinit.vec.reshape(plan.shape), 0, sampling_count)]
+
+    for step in progress_range(step_bound, "Stepping", progress):
+        if len(frontier) == 0:
+            break
+
+        merged : Dict[Tuple[int, bytes], Tuple[np.ndarray, int, int]] = {}
+        for stt, vid, count in frontier:
+            for next_stt, next_vid, next_count in branch_next(plan, vid, stt, count, rng):
+                if next_vid == -1:
+                    # record the terminated states
+                    res.record(VVec(vinit.qvar, next_stt.reshape((-1,))), step, next_count)
+                    continue
+
+                # merge the branches with the same state (up to rounding) at the same vertex
+                key = (next_vid, (np.round(next_stt, 12) + 0.).tobytes())
+                if key in merged:
+                    next_count += merged[key][2]
+                merged[key] = (next_stt, next_vid, next_count)
+
+        frontier = list(merged.values())
+
+    # the unterminated states are only recorded after some steps
+    if step_bound > 0:
+        for stt, vid, count in frontier:
+            res.record(None, step_bound, count)
+
+
+
+def vecsim_shot(fc : Flowchart, vinit : VVec, step_bound : int, sampling_count : int,
+                res : VecSimRes, rng : np.random.Generator, progress = True) -> None:
+    '''
+    the vector simulation running the samplings one after another.
+    '''
+    plan = fc.plan(vinit.qvar)
+    init = vinit.vec.reshape(plan.shape)
+
+    for count in progress_range(sampling_count, "Sampling", progress):
+        vid, stt = 0, init
+
+        for step in range(step_bound):
+            next_vid, next_stt = plan_next(plan, vid, stt, rng) 
+            if next_vid == -1:
+                # record the state
+                res.record(VVec(vinit.qvar, stt.reshape((-1,))), step)
+                break
+            vid, stt = next_vid, next_stt
+
+        # record the unterminated state, only after some steps
+        else:
+            if step_bound > 0:
+                res.record(None, step_bound)
+
+
+engines = {
+    "shot" : vecsim_shot,
+    "batch" : vecsim_batch,
+    "branch" : vecsim_branch,
+}
+
+def vecsim_worker(fc : Flowchart, vinit : VVec, step_bound : int, sampling_count : int,
+                  mode : str, seed : np.random.SeedSequence, progress = True) -> List[VecRecord]:
+    '''
+    run one shard of the simulation with its own random stream, and return the records only
+    '''
+    res = VecSimRes(fc, vinit, step_bound)
+    engines[mode](fc, vinit, step_bound, sampling_count, res, np.random.default_rng(seed), progress)
+    return res.records
+
+
+def vecsim(fc : Flowchart, vinit : VVec, step_bound = 500, sampling_count = 1, 
+           mode = "shot", seed : int | None = None, workers = 1) -> VecSimRes:
     '''
     conduct the vector simulation on flowchart [fc]
     fc : compiled flowchart
     vinit : initial quantum state vector (normalized)
     step_bound : maximum count of executed steps. The machine will stop in the unterminated state afterwards.
     sampling_count : number of sampling
+    mode : "shot" runs the samplings one after another,
+        "batch" steps all the samplings together with vectorized operations (see [vecsim_batch]),
+        "branch" calculates every distinct branch once and splits the sampling counts (see [vecsim_branch]).
+    seed : the seed for the random streams. The result is reproducible for the same seed and workers.
+    workers : number of processes. The samplings are sharded evenly, and every shard has an 
+        independent random stream derived from [seed].
     '''
-
-    random.seed()
+    if mode not in engines:
+        raise ValueError("Unknown simulation mode: " + str(mode))
+    
+    if workers < 1:
+        raise ValueError("The number of workers should be at least 1: " + str(workers))
 
     # check the initial state vector
     vnorm2 = vinit.norm2()
@@ -183,24 +579,29 @@ def vecsim(fc : Flowchart, vinit : VVec, step_bound = 500, sampling_count = 1) -
         raise ValueError("Invalid initial state vector")
     
     res = VecSimRes(fc, vinit, step_bound)
-    ms = MachineState(vinit, fc.vertices[0])
 
-    for count in tqdm(range(sampling_count), desc = "Sampling"):
-        cur_ms : MachineState = ms
+    # allocate the state on the whole register once
+    reg = vinit.qvar + fc.register
+    vinit = vinit.extend_to(reg)
 
-        next_ms = None
-        for step in range(step_bound):
-            next_ms = cur_ms.next(fc) 
-            if next_ms is None:
-                # record the state
-                res.record(cur_ms.vstate, step)
-                break
-            cur_ms = next_ms
+    seeds = np.random.SeedSequence(seed).spawn(workers)
 
-        # record the state
-        if next_ms is not None:
-            res.record(None, step_bound)
+    if workers == 1:
+        res.records = vecsim_worker(fc, vinit, step_bound, sampling_count, mode, seeds[0])
+        return res
+    
+    counts = [sampling_count // workers + (1 if i < sampling_count % workers else 0) 
+              for i in range(workers)]
+
+    # multiprocessing is slow to import, and only needed here
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = [pool.submit(vecsim_worker, fc, vinit, step_bound, counts[i], mode, seeds[i], False)
+                   for i in range(workers)]
+        
+        for future in futures:
+            part = VecSimRes(fc, vinit, step_bound)
+            part.records = future.result()
+            res.merge(part)
 
     return res
-
-